@@ -0,0 +1,126 @@
+import io
+import os
+import time
+import threading
+from PIL import Image
+from gen_bottle_mask_4 import TILE_MIN_PIXELS
+from metrics import add_stage
+
+# 准入控制：按文件头里的尺寸估算峰值内存，单个 web worker 的内存预算 (MB)；扣掉常驻缓存的上限后由所有请求共享
+ADMISSION_BUDGET_MB = int(os.environ.get('ADMISSION_BUDGET_MB', 512))
+# 扣掉缓存后至少留给请求的预算
+ADMISSION_MIN_MB = 64
+ADMISSION_WAIT = float(os.environ.get('ADMISSION_WAIT', 10))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 5))
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', 32))
+
+# 每像素峰值字节数 (解码 + RGBA 副本 + 距离场等)，超大图走分条路径时只剩解码后的整图；抠图另加模型推理的固定开销
+PIXEL_BYTES = {'shrink': 32, 'vectorize': 16, 'matting': 44}
+TILED_PIXEL_BYTES = {'shrink': 6, 'vectorize': 16, 'matting': 10}
+MODE_BASE_MB = {'shrink': 16, 'vectorize': 16, 'matting': 160}
+# SVG 按源文件大小估算 (解析后的路径对象 + 几何运算)
+SVG_BYTES_FACTOR = 60
+MB = 1024 * 1024
+
+class Overloaded(Exception):
+    def __init__(self, retry_after=ADMISSION_RETRY_AFTER):
+        super().__init__('服务器繁忙，请稍后重试')
+        self.retry_after = retry_after
+
+def image_size(data):
+    """只读文件头取 (宽, 高)，不解码像素；无法识别时返回 None"""
+    try:
+        with Image.open(io.BytesIO(data)) as img: return img.size
+    except Exception:
+        return None
+
+def estimate_mb(mode, size=None, params=None, svg_bytes=0, tiled=None):
+    """估算单个文件处理时的峰值内存 (MB)；抠图描边会把画布四周扩出 stroke_width+5 像素"""
+    if mode == 'pipeline':
+        # 流水线不分条，各步的中间图都整张留在内存里：取最重的一步，再加上一份 RGBA 中间图
+        steps = (params or {}).get('steps') or []
+        extra = 4 * size[0] * size[1] / MB if size else 0
+        return max((estimate_mb(step['mode'], size, step, svg_bytes, tiled=False) for step in steps), default=16) + extra
+    base = MODE_BASE_MB.get(mode, 16)
+    if svg_bytes: return base + svg_bytes * SVG_BYTES_FACTOR / MB
+    if not size: return base
+    w, h = size
+    stroke = (params or {}).get('stroke_width', 0)
+    pad = stroke + 5 if mode == 'matting' and stroke > 0 else 0
+    if tiled is None: tiled = w * h > TILE_MIN_PIXELS
+    per_pixel = (TILED_PIXEL_BYTES if tiled else PIXEL_BYTES).get(mode, 32)
+    return base + (w + 2 * pad) * (h + 2 * pad) * per_pixel / MB
+
+def fit_edge(mode, size, params, budget_mb=ADMISSION_BUDGET_MB):
+    """预算内能处理的最长边 (像素)，用于把放不下的预览降采样"""
+    modes = [step['mode'] for step in (params or {}).get('steps') or []] if mode == 'pipeline' else [mode]
+    base = max((MODE_BASE_MB.get(m, 16) for m in modes), default=16)
+    scale = ((budget_mb - base) / max(estimate_mb(mode, size, params) - base, 1e-6)) ** 0.5
+    return max(64, int(max(size) * min(scale, 1.0)))
+
+class AdmissionController:
+    """线程安全的内存配额：放得下就立即放行，否则排队等待，超时抛出 Overloaded (对应 503 + Retry-After)"""
+    def __init__(self, budget_mb=ADMISSION_BUDGET_MB, wait=ADMISSION_WAIT):
+        self.budget_mb = budget_mb
+        self.wait = wait
+        self.in_use = 0.0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def fits(self, mb):
+        return mb <= self.budget_mb
+
+    def reserve(self, mb):
+        """常驻缓存占用的内存从请求预算里扣掉"""
+        with self._cond:
+            self.budget_mb = max(ADMISSION_MIN_MB, self.budget_mb - mb)
+
+    def acquire(self, mb, timeout=None):
+        timeout = self.wait if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                # 空闲时总是放行一个请求，避免估算偏大时永远进不来
+                while self.in_use > 0 and self.in_use + mb > self.budget_mb:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise Overloaded()
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_use += mb
+            self.admitted += 1
+        # 排队等待的时间单独记一个阶段
+        add_stage('queue', time.monotonic() - started)
+        return mb
+
+    def release(self, mb):
+        with self._cond:
+            self.in_use = max(0.0, self.in_use - mb)
+            self._cond.notify_all()
+
+    def admit(self, mb, timeout=None):
+        return _Admission(self, mb, timeout)
+
+    def stats(self):
+        with self._cond:
+            return {'budget_mb': self.budget_mb, 'in_use_mb': round(self.in_use, 1), 'waiting': self.waiting,
+                    'admitted': self.admitted, 'rejected': self.rejected}
+
+class _Admission:
+    def __init__(self, controller, mb, timeout):
+        self.controller, self.mb, self.timeout = controller, mb, timeout
+
+    def __enter__(self):
+        self.controller.acquire(self.mb, self.timeout)
+        return self
+
+    def __exit__(self, *exc):
+        self.controller.release(self.mb)
+
+admission = AdmissionController()
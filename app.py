@@ -1,78 +1,323 @@
 import os
-import zipfile
-import tempfile
-import shutil
-import base64
+import io
 import gc
-from flask import Flask, render_template, request, send_file, after_this_request, jsonify
+import json
+import itertools
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Flask, Response, render_template, request, send_file, jsonify, g
 from werkzeug.utils import secure_filename
-from gen_bottle_mask_4 import process_bottle_svg, process_raster_image, convert_bitmap_to_svg, remove_background_ai
+from PIL import Image
+from batch import run_batch, iter_zip, pool_pids, web_resident_mb, PROCESS_WORKERS
+from jobs import job_manager, JOB_EVENT_STREAMS, JOB_EVENTS_TIMEOUT, JOB_EVENTS_RETRY
+from result_cache import result_cache, result_key, source_keys, etag_for
+from admission import admission, Overloaded, image_size, estimate_mb, fit_edge, JOB_QUEUE_MAX
+from gen_bottle_mask_4 import (process_data, parse_steps, check_svg_steps, open_proxy_image, scale_params, preload_models,
+                               PREVIEW_MAX_EDGE, PREVIEW_ENCODING, RASTER_ENCODINGS, RASTER_MIMETYPES, matting_model, matting_speed,
+                               mask_cache, contour_cache, field_cache)
+import metrics
+from metrics import stage, add_bytes
 
 app = Flask(__name__)
+# 配置了 MATTING_PRELOAD 时在 worker 启动阶段加载 (并可预热) 模型，否则首次抠图时再加载
+preload_models()
 ALLOWED_EXTENSIONS = {'svg', 'png', 'jpg', 'jpeg', 'webp', 'bmp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class StoredImage:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = data
+        self.digest = hashlib.sha1(data).hexdigest()
+        self.image = None
+        self.proxies = {}
+        self.nbytes = len(data)
+        self.atime = time.time()
+        self.size = None if self.is_svg else image_size(data)
+
+    @property
+    def is_svg(self):
+        return self.filename.lower().endswith('.svg')
+
+class ImageStore:
+    """上传一次、多次预览：按 ID 保存原始字节和解码后的图像，空闲过期 + 单 worker 内存上限"""
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.time()
+        for image_id in [k for k, v in self._items.items() if now - v.atime > self.ttl]:
+            self.size -= self._items.pop(image_id).nbytes
+        while self.size > self.max_bytes and len(self._items) > 1:
+            _, item = self._items.popitem(last=False)
+            self.size -= item.nbytes
+
+    def add(self, filename, data):
+        item = StoredImage(filename, data)
+        image_id = uuid.uuid4().hex
+        with self._lock:
+            self._items[image_id] = item
+            self.size += item.nbytes
+            self._evict()
+        return image_id
+
+    def get(self, image_id):
+        with self._lock:
+            self._evict()
+            item = self._items.get(image_id)
+            if item is not None:
+                item.atime = time.time()
+                self._items.move_to_end(image_id)
+            return item
+
+    def decoded(self, item):
+        # 首次使用时解码一次，之后的预览/导出直接复用
+        if item.image is None:
+            img = Image.open(io.BytesIO(item.data))
+            img.load()
+            with self._lock:
+                if item.image is None:
+                    item.image = img
+                    extra = img.width * img.height * len(img.getbands())
+                    item.nbytes += extra
+                    self.size += extra
+                    self._evict()
+        return item.image
+
+    def proxy(self, item, max_edge):
+        # 预览代理图按最长边缓存；JPEG 直接从原始字节 draft 解码，不必先解出整张大图
+        cached = item.proxies.get(max_edge)
+        if cached is None:
+            src = item.image if item.image is not None else io.BytesIO(item.data)
+            img, scale = open_proxy_image(src, max_edge)
+            if scale == 1: return self.decoded(item), 1.0
+            img.load()
+            cached = (img, scale)
+            with self._lock:
+                if max_edge not in item.proxies:
+                    item.proxies[max_edge] = cached
+                    extra = img.width * img.height * len(img.getbands())
+                    item.nbytes += extra
+                    self.size += extra
+                    self._evict()
+        return cached
+
+image_store = ImageStore(int(os.environ.get('IMAGE_STORE_MB', 64)) * 1024 * 1024,
+                         int(os.environ.get('IMAGE_STORE_TTL', 900)))
+# 上传会话和各级缓存都常驻在 worker 里，按上限从请求的内存预算里扣掉
+admission.reserve((image_store.max_bytes + mask_cache.max_bytes + field_cache.max_bytes + contour_cache.max_bytes
+                   + result_cache.memory.max_bytes) / (1024 * 1024))
+
+def read_params(form):
+    params = {}
+    for name, cast, default in (('indent', int, 8), ('smoothness', int, 4), ('radius', float, 0),
+                                ('threshold', int, 10), ('shift', int, 0), ('stroke_width', int, 0)):
+        try: params[name] = cast(form.get(name, default))
+        except: params[name] = default
+    params['stroke_color'] = form.get('stroke_color', '#FFFFFF')
+    params['stroke_pos'] = form.get('stroke_pos', 'outer')
+    params['model'] = matting_model(form.get('model'))
+    params['speed'] = matting_speed(form.get('speed'))
+    return params
+
+def request_filenames():
+    """本次请求涉及的文件名：上传的 file/files 和 image_id(s) 对应的已上传会话"""
+    names = [f.filename for f in request.files.getlist('file') + request.files.getlist('files')]
+    for image_id in request.form.getlist('image_id') + request.form.getlist('image_ids'):
+        item = image_store.get(image_id) if image_id else None
+        if item: names.append(item.filename)
+    return names
+
+def read_mode(form, params):
+    """带 steps (JSON 步骤列表) 时按流水线处理，一次请求依次执行各步；步骤或参数不合法、只有 SVG 却配了栅格步骤时抛 ValueError"""
+    if not form.get('steps'): return form.get('mode', 'shrink')
+    params['steps'] = parse_steps(form['steps'])
+    # 全是 SVG 时整个请求都处理不了；混有位图的批处理里 SVG 单独记为失败，其余照常处理
+    names = request_filenames()
+    if names and all((name or '').lower().endswith('.svg') for name in names): check_svg_steps(params['steps'])
+    return 'pipeline'
+
+def overloaded(e, as_json=True):
+    body = jsonify({'error': str(e)}) if as_json else str(e)
+    return body, 503, {'Retry-After': str(e.retry_after)}
+
+def proxy_size(size, max_edge):
+    if not size or not max_edge or max(size) <= max_edge: return size
+    scale = max_edge / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def source_estimate(mode, filename, data, params):
+    if filename.lower().endswith('.svg'): return estimate_mb(mode, params=params, svg_bytes=len(data))
+    return estimate_mb(mode, image_size(data), params)
+
+def result_response(key, ext, body):
+    """带 ETag 的结果响应；客户端带着相同的 If-None-Match 再来时直接 304"""
+    response = Response(body, mimetype=RASTER_MIMETYPES.get(ext, 'application/octet-stream'),
+                        headers={'Cache-Control': 'no-cache'})
+    response.set_etag(key)
+    return response
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def stored_source(item, max_edge=0):
+    """把会话里的图片交给处理函数：SVG 直接传原始字节，位图传解码结果 (max_edge>0 时为预览代理图)"""
+    filename = secure_filename(item.filename)
+    if item.is_svg: return filename, item.data, 1.0
+    if max_edge: return (filename,) + image_store.proxy(item, max_edge)
+    return filename, image_store.decoded(item), 1.0
+
+def collect_sources():
+    """汇总批处理输入：已上传会话的 image_ids + 本次上传的 files，返回 (sources, 错误响应)"""
+    image_ids = [i for i in request.form.getlist('image_ids') if i]
+    items = [image_store.get(i) for i in image_ids]
+    if any(item is None for item in items): return None, ("图片已过期，请重新选择文件", 410)
+    raw_files = request.files.getlist('files')
+    files = [f for f in raw_files if f.filename != '']
+    if not files and not items: return None, ("没有选择任何文件", 400)
+    sources = [(secure_filename(item.filename), item.data, item.digest) for item in items]
+    for file in files:
+        if file and allowed_file(file.filename):
+            sources.append((secure_filename(file.filename), file.read(), None))
+    return sources, None
+
+@app.before_request
+def start_timing():
+    # 请求内各阶段先记在 recorder 上，响应时写入 Server-Timing 并一次性计入直方图
+    g.recorder = metrics.start_recording(capture=True)
+    if request.method == 'POST':
+        with stage('upload'): request.form, request.files
+        add_bytes('upload', request.content_length or 0)
+
+@app.after_request
+def finish_timing(response):
+    recorder = g.get('recorder')
+    if recorder is None: return response
+    total = time.perf_counter() - recorder.started
+    if not response.is_streamed: add_bytes('response', response.content_length or 0)
+    response.headers['Server-Timing'] = metrics.server_timing(recorder, total)
+    endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+    metrics.request_seconds.observe(total, endpoint, response.status_code)
+    metrics.requests_total.inc(endpoint, response.status_code)
+    metrics.stop_recording(recorder)
+    g.recorder = None
+    metrics.observe_stages(recorder.durations, recorder.bytes)
+    return response
+
+@app.teardown_request
+def stop_timing(exc=None):
+    # 出错没走到 after_request 时也要恢复线程上的记录器；流式响应的后续阶段直接计入直方图
+    recorder = g.get('recorder')
+    if recorder is not None: metrics.stop_recording(recorder)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式：阶段耗时/字节数直方图、请求数、队列深度、缓存和各 worker 的 RSS"""
+    admitted = admission.stats()
+    caches = {'mask': mask_cache.stats(), 'contour': contour_cache.stats(), 'field': field_cache.stats(),
+              'result': result_cache.stats()}
+    workers = {(os.getpid(), 'web'): metrics.rss_bytes()}
+    workers.update({(pid, 'pool'): metrics.rss_bytes(pid) for pid in pool_pids()})
+    extra = [
+        metrics.gauge('bottle_job_queue_depth', '排队和运行中的后台任务数', {(): job_manager.depth}),
+        metrics.gauge('bottle_admission_waiting', '等待内存配额的请求数', {(): admitted['waiting']}),
+        metrics.gauge('bottle_admission_in_use_mb', '已分配的内存配额 (MB)', {(): admitted['in_use_mb']}),
+        metrics.gauge('bottle_admission_budget_mb', '内存配额上限 (MB)', {(): admitted['budget_mb']}),
+        metrics.gauge('bottle_admission_rejected_total', '因配额不足返回 503 的请求数',
+                      {(): admitted['rejected']}, kind='counter'),
+        metrics.gauge('bottle_cache_hits_total', '缓存命中数', {(k,): v['hits'] for k, v in caches.items()},
+                      ('cache',), kind='counter'),
+        metrics.gauge('bottle_cache_misses_total', '缓存未命中数', {(k,): v['misses'] for k, v in caches.items()},
+                      ('cache',), kind='counter'),
+        metrics.gauge('bottle_cache_bytes', '缓存占用 (字节)', {(k,): v['bytes'] for k, v in caches.items()},
+                      ('cache',)),
+        metrics.gauge('bottle_image_store_bytes', '上传会话占用 (字节)', {(): image_store.size}),
+        metrics.gauge('bottle_worker_rss_bytes', '各进程常驻内存 (字节)', workers, ('pid', 'role')),
+    ]
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/upload', methods=['POST'])
+def upload_images():
+    files = [f for f in request.files.getlist('file') + request.files.getlist('files') if f.filename != '']
+    files = [f for f in files if allowed_file(f.filename)]
+    if not files: return jsonify({'error': 'No file'}), 400
+    ids = [image_store.add(secure_filename(f.filename), f.read()) for f in files]
+    return jsonify({'id': ids[0], 'ids': ids})
+
 @app.route('/preview', methods=['POST'])
 def preview_image():
     try:
-        gc.collect() # 强制内存回收
-        mode = request.form.get('mode', 'shrink')
+        params = read_params(request.form)
+        try: mode = read_mode(request.form, params)
+        except ValueError as e: return jsonify({'error': str(e)}), 400
+        params['color'] = request.form.get('color', '#FFFFFF')
+        try: max_edge = int(request.form.get('max_edge', PREVIEW_MAX_EDGE))
+        except: max_edge = PREVIEW_MAX_EDGE
+        encoding = request.form.get('encoding', PREVIEW_ENCODING)
+        if encoding not in RASTER_ENCODINGS: encoding = PREVIEW_ENCODING
+        image_id = request.form.get('image_id')
         file = request.files.get('file')
-        if not file: return jsonify({'error': 'No file'}), 400
-
-        try: indent = int(request.form.get('indent', 8))
-        except: indent = 8
-        try: smoothness = int(request.form.get('smoothness', 4))
-        except: smoothness = 4
-        try: radius = float(request.form.get('radius', 0))
-        except: radius = 0
-        color = request.form.get('color', '#FFFFFF')
-        try: threshold = int(request.form.get('threshold', 10))
-        except: threshold = 10
-        try: shift = int(request.form.get('shift', 0))
-        except: shift = 0
-        try: s_width = int(request.form.get('stroke_width', 0))
-        except: s_width = 0
-        s_color = request.form.get('stroke_color', '#FFFFFF')
-        s_pos = request.form.get('stroke_pos', 'outer')
-
-        temp_dir = tempfile.mkdtemp()
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(temp_dir, filename)
-        output_path = os.path.join(temp_dir, 'preview_' + filename)
-        
-        file.save(input_path)
-        result_path = output_path
-        
-        if mode == 'shrink':
-            # ... (简化代码结构) ...
-            if filename.endswith('.svg'): process_bottle_svg(input_path, output_path, shrink_px=indent)
-            else: 
-                result_path = os.path.splitext(output_path)[0] + ".png"
-                process_raster_image(input_path, result_path, shrink_px=indent)
-        elif mode == 'vectorize':
-            result = convert_bitmap_to_svg(input_path, output_path, fill_color=color, smoothness=smoothness, corner_radius=radius)
-            if result: result_path = result
-        elif mode == 'matting':
-            result_path = os.path.splitext(output_path)[0] + ".png"
-            remove_background_ai(input_path, result_path, 
-                                 alpha_threshold=threshold, edge_shift=shift,
-                                 stroke_width=s_width, stroke_color=s_color, stroke_pos=s_pos)
-
-        with open(result_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        mime_type = "image/svg+xml" if result_path.endswith('.svg') else "image/png"
-        shutil.rmtree(temp_dir)
-        gc.collect() # 再次强制回收
-        return jsonify({'image': f"data:{mime_type};base64,{encoded_string}"})
+        item = image_store.get(image_id) if image_id else None
+        if image_id and item is None: return jsonify({'error': 'expired'}), 404
+        if not item and not file: return jsonify({'error': 'No file'}), 400
+
+        data = None if item else file.read()
+        filename = secure_filename(item.filename if item else file.filename)
+        is_svg = filename.lower().endswith('.svg')
+        # 先按文件头估算内存：预算放不下时把预览降采样，预算被占满时排队，等不到就返回 503
+        if is_svg:
+            mb = estimate_mb(mode, params=params, svg_bytes=len(item.data if item else data))
+        else:
+            size = item.size if item else image_size(data)
+            mb = estimate_mb(mode, proxy_size(size, max_edge), params)
+            if size and not admission.fits(mb):
+                max_edge = min(max_edge or max(size), fit_edge(mode, size, params, admission.budget_mb))
+                mb = estimate_mb(mode, proxy_size(size, max_edge), params)
+            if size and max_edge and max(size) <= max_edge: max_edge = 0
+
+        # 同一内容 + 模式 + 参数 + 代理尺寸 + 编码只算一次
+        key = result_key(item.digest if item else hashlib.sha1(data).hexdigest(), mode, params,
+                         0 if is_svg else max_edge, None if is_svg else encoding)
+        if request.if_none_match.contains(key): return not_modified(key)
+        with stage('cache'): hit = result_cache.get(key)
+        if hit is not None: return result_response(key, *hit)
+
+        gc.collect() # 强制内存回收
+        with admission.admit(mb):
+            # 全程在内存里：上传的字节直接解码/解析，结果直接编码成响应体，不再落盘
+            with stage('proxy'):
+                if item:
+                    filename, source, scale = stored_source(item, max_edge)
+                    params['content_key'] = item.digest if scale == 1 else f"{item.digest}@{max_edge}"
+                else:
+                    source, scale = (data, 1.0) if is_svg else open_proxy_image(data, max_edge)
+
+            # 预览在代理图上运行，像素参数按比例缩放；/process 始终输出原图分辨率
+            result = process_data(mode, source, encoding=encoding, **scale_params(params, scale))
+            if result is None: raise RuntimeError('处理失败')
+            ext, body = result
+            gc.collect() # 再次强制回收
+        result_cache.put(key, ext, body)
+        # 直接返回二进制图像，不再 base64 + JSON
+        return result_response(key, ext, body)
 
+    except Overloaded as e:
+        return overloaded(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -80,71 +325,119 @@ def preview_image():
 def process_files():
     try:
         gc.collect()
-        mode = request.form.get('mode', 'shrink')
-        # ... (参数获取逻辑省略，保持原样) ...
-        try: indent = int(request.form.get('indent', 8))
-        except: indent = 8
-        try: smoothness = int(request.form.get('smoothness', 4))
-        except: smoothness = 4
-        try: radius = float(request.form.get('radius', 0))
-        except: radius = 0
-        try: threshold = int(request.form.get('threshold', 10))
-        except: threshold = 10
-        try: shift = int(request.form.get('shift', 0))
-        except: shift = 0
-        try: s_width = int(request.form.get('stroke_width', 0))
-        except: s_width = 0
-        s_color = request.form.get('stroke_color', '#FFFFFF')
-        s_pos = request.form.get('stroke_pos', 'outer')
-        
-        raw_files = request.files.getlist('files')
-        files = [f for f in raw_files if f.filename != '']
-        if not files: return "没有选择任何文件", 400
-
-        temp_dir = tempfile.mkdtemp()
-        input_dir = os.path.join(temp_dir, 'input')
-        output_dir = os.path.join(temp_dir, 'processed')
-        os.makedirs(input_dir); os.makedirs(output_dir)
-
-        processed_count = 0
-        for file in files:
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                input_path = os.path.join(input_dir, filename)
-                output_path = os.path.join(output_dir, filename)
-                file.save(input_path)
-                try:
-                    if mode == 'shrink':
-                        if filename.lower().endswith('.svg'): process_bottle_svg(input_path, output_path, shrink_px=indent)
-                        else: process_raster_image(input_path, os.path.splitext(output_path)[0] + ".png", shrink_px=indent)
-                    elif mode == 'vectorize':
-                        convert_bitmap_to_svg(input_path, output_path, fill_color='black', smoothness=smoothness, corner_radius=radius)
-                    elif mode == 'matting':
-                        remove_background_ai(input_path, os.path.splitext(output_path)[0] + ".png", 
-                                             alpha_threshold=threshold, edge_shift=shift,
-                                             stroke_width=s_width, stroke_color=s_color, stroke_pos=s_pos)
-                    processed_count += 1
-                    gc.collect()
-                except: pass
-
-        if processed_count == 0: return "处理失败", 400
-
-        zip_filename = f"{mode}_processed.zip"
-        zip_path = os.path.join(temp_dir, zip_filename)
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    zipf.write(os.path.join(root, file), file)
-
-        @after_this_request
-        def remove_temp_dir(response):
-            try: shutil.rmtree(temp_dir)
-            except: pass
+        params = read_params(request.form)
+        try: mode = read_mode(request.form, params)
+        except ValueError as e: return str(e), 400
+
+        sources, error = collect_sources()
+        if error: return error
+        # 文件都不是允许的类型时没有可处理的输入
+        if not sources: return "处理失败\n", 400
+        # ZIP 的 ETag 由各文件名和结果键决定，内容和参数都没变时直接 304
+        sources, keys = source_keys(mode, sources, params)
+        etag = etag_for([[name, key] for (name, _, _), key in zip(sources, keys)])
+        if request.if_none_match.contains(etag): return not_modified(etag)
+
+        # 处理在进程池里进行，web 进程只占上传的字节和待发送的结果；单进程配置在本进程里处理，按最大的单个文件估算。
+        # 超出预算的按整份预算算，直到 ZIP 发送完毕才释放
+        if PROCESS_WORKERS > 1: mb = web_resident_mb(mode, sources)
+        else: mb = max(source_estimate(mode, name, data, params) for name, data, _ in sources)
+        mb = min(mb, admission.budget_mb)
+        admission.acquire(mb)
+        try:
+            # 先等到第一个成功的文件再开始响应：全部失败时仍能返回 400
+            results = run_batch(mode, sources, params)
+            errors = []
+            first = None
+            for result in results:
+                if result[3]:
+                    errors.append(f"{result[0]}: {result[3]}")
+                    continue
+                first = result
+                break
+        except BaseException:
+            admission.release(mb)
+            raise
+        if first is None:
+            admission.release(mb)
+            return "处理失败\n" + "\n".join(errors), 400
+
+        # 配额在 ZIP 发完或连接关闭时释放 (只释放一次)
+        released = []
+        def release():
+            if not released:
+                released.append(True)
+                admission.release(mb)
+
+        # 流式返回 ZIP：每处理完一个文件就发送，不再先整包落盘
+        def generate():
+            try: yield from iter_zip(itertools.chain([first], results), errors)
+            finally: release()
             gc.collect()
-            return response
-        return send_file(zip_path, as_attachment=True)
+        response = Response(generate(), mimetype='application/zip',
+                            headers={'Content-Disposition': f'attachment; filename={mode}_processed.zip'})
+        response.call_on_close(release)
+        response.set_etag(etag)
+        return response
+    except Overloaded as e:
+        return overloaded(e, as_json=False)
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    params = read_params(request.form)
+    try: mode = read_mode(request.form, params)
+    except ValueError as e: return jsonify({'error': str(e)}), 400
+    sources, error = collect_sources()
+    if error: return jsonify({'error': error[0]}), error[1]
+    # 队列已满时直接拒绝，让客户端稍后重试，而不是无限堆积
+    if job_manager.depth >= JOB_QUEUE_MAX: return overloaded(Overloaded())
+    job = job_manager.submit(mode, sources, params)
+    return jsonify({'id': job.id, 'status_url': f'/jobs/{job.id}', 'events_url': f'/jobs/{job.id}/events',
+                    'download_url': f'/jobs/{job.id}/download'}), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None: return jsonify({'error': 'not found'}), 404
+    return jsonify(job.to_dict())
+
+event_streams = threading.BoundedSemaphore(JOB_EVENT_STREAMS)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None: return jsonify({'error': 'not found'}), 404
+
+    # SSE：任务状态每变化一次推送一条，空闲时发送注释保持连接；连接数和时长有上限，到时断开由浏览器按 retry 重连。
+    # 没有空闲名额时只推一次当前状态就断开，相当于按 retry 间隔轮询
+    def generate():
+        streaming = event_streams.acquire(blocking=False)
+        try:
+            yield f"retry: {int(JOB_EVENTS_RETRY * 1000)}\n\n"
+            current, version = job, -1
+            deadline = time.monotonic() + (JOB_EVENTS_TIMEOUT if streaming else 0)
+            while True:
+                if version == current.version:
+                    yield ": keep-alive\n\n"
+                else:
+                    version = current.version
+                    yield f"data: {json.dumps(current.to_dict(), ensure_ascii=False)}\n\n"
+                    if current.done: return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return
+                current = job_manager.wait(current, version, min(15, remaining))
+        finally:
+            if streaming: event_streams.release()
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = job_manager.get(job_id)
+    if job is None: return jsonify({'error': 'not found'}), 404
+    if job.status != 'done': return jsonify(job.to_dict()), 409
+    return send_file(job.archive_path, as_attachment=True, download_name=f"{job.mode}_processed.zip")
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,240 @@
+import os
+import gc
+import time
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from gen_bottle_mask_4 import (process_data, process_files_batch, preload_models, matting_batch_size, open_image,
+                               MemoryOutput, MATTING_IMAGE_MB)
+from result_cache import result_cache, result_key, source_keys, cached_name
+from metrics import recording, observe_stages, stage, add_bytes
+
+# 批处理进程池：worker 数量上限 + 总内存预算 (MB)，按模式估算单个任务的峰值内存
+PROCESS_WORKERS = int(os.environ.get('PROCESS_WORKERS', os.cpu_count() or 1))
+PROCESS_MEM_BUDGET_MB = int(os.environ.get('PROCESS_MEM_BUDGET_MB', 1024))
+# 输出字节相对输入字节的倍数上限 (JPEG 抠图后输出 PNG 会明显变大)
+RESULT_BYTES_FACTOR = 4
+MODE_MEM_MB = {'shrink': 120, 'vectorize': 120, 'matting': 300, 'pipeline': 300}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def max_parallel(mode, chunk_size=1):
+    # 抠图按批推理时，每多一张图多占 MATTING_IMAGE_MB
+    per_task = MODE_MEM_MB.get(mode, 120) + (MATTING_IMAGE_MB * (chunk_size - 1) if mode == 'matting' else 0)
+    return max(1, min(PROCESS_WORKERS, PROCESS_MEM_BUDGET_MB // per_task))
+
+def matting_chunk_size():
+    """抠图每批张数：在自动批量的基础上，保证内存预算至少能同时容纳两个任务，否则进程池只剩一个窗口"""
+    cap = (PROCESS_MEM_BUDGET_MB // 2 - MODE_MEM_MB['matting']) // MATTING_IMAGE_MB + 1
+    return max(1, min(matting_batch_size(), cap))
+
+def web_resident_mb(mode, sources):
+    """批处理时 web 进程里常驻的内存 (MB)：上传的字节 + 进程池窗口内还没发出的结果；计算本身在池进程里"""
+    sizes = [len(data) for _, data, _ in sources]
+    size = matting_chunk_size() if mode == 'matting' else 1
+    in_flight = max_parallel(mode, size) * size * max(sizes, default=0) * RESULT_BYTES_FACTOR
+    return (sum(sizes) + in_flight) / (1024 * 1024)
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn 启动：不继承 web 进程里已初始化的 onnxruntime 线程池，模型在 worker 内按需加载
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=preload_models)
+        return _pool
+
+def pool_pids():
+    with _pool_lock:
+        return list(_pool._processes) if _pool is not None else []
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None: _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def process_one(mode, filename, data, params, content_key=None):
+    """在 worker 内处理单个文件，输入输出都在内存里，返回 (输出文件名, 输出字节, 各阶段耗时)"""
+    timings = {}
+    t0 = time.perf_counter()
+    try:
+        # SVG 直接解析字节，位图只读文件头，像素在处理函数里按需解码
+        source = data if filename.lower().endswith('.svg') else open_image(data)
+        t1 = time.perf_counter()
+        with recording(capture=True) as recorder:
+            result = process_data(mode, source, content_key=content_key or hashlib.sha1(data).hexdigest(), **params)
+        if result is None: raise RuntimeError('处理失败')
+        timings['load'] = t1 - t0
+        timings['process'] = time.perf_counter() - t1
+        timings.update(stage_timings(recorder))
+        return cached_name(filename, result[0]), result[1], timings
+    finally:
+        gc.collect()
+
+def process_chunk(mode, chunk, params):
+    """在 worker 内处理一组文件，返回 [(文件名, 输出名, 输出字节, 错误, 耗时)]；抠图模式整组拼批推理"""
+    if mode != 'matting' or len(chunk) == 1:
+        results = []
+        for filename, data, digest in chunk:
+            try:
+                out_name, out_data, timings = process_one(mode, filename, data, params, digest)
+                results.append((filename, out_name, out_data, None, timings))
+            except Exception as e:
+                results.append((filename, None, None, error_text(e), {}))
+        return results
+    try:
+        t0 = time.perf_counter()
+        outputs = [MemoryOutput() for _ in chunk]
+        keys = [digest or hashlib.sha1(data).hexdigest() for _, data, digest in chunk]
+        with recording(capture=True) as recorder:
+            process_files_batch(mode, [data for _, data, _ in chunk], outputs, keys, **params)
+        # 整批推理的耗时 (包括各阶段) 平摊到每个文件
+        per_file = (time.perf_counter() - t0) / len(chunk)
+        stages = stage_timings(recorder, len(chunk))
+        results = []
+        for (filename, _, _), output in zip(chunk, outputs):
+            if not output.ext or not output.tell():
+                results.append((filename, None, None, '处理失败', {}))
+                continue
+            results.append((filename, cached_name(filename, output.ext), output.getvalue(), None,
+                            {'process': per_file, 'batch': len(chunk), **stages}))
+        return results
+    except Exception as e:
+        # 整批推理失败时每个文件都记为失败 (单进程配置在调用线程里跑，不能让异常打断整个批处理)
+        return [(filename, None, None, error_text(e), {}) for filename, _, _ in chunk]
+    finally:
+        gc.collect()
+
+def stage_timings(recorder, share=1):
+    """worker 内记录的阶段耗时/字节数展开成扁平的 timings 项，字节数以 _bytes 结尾"""
+    timings = {name: seconds / share for name, seconds in recorder.durations.items()}
+    timings.update({f'{name}_bytes': n // share for name, n in recorder.bytes.items()})
+    return timings
+
+def observe_timings(timings):
+    """在主进程里把 worker 返回的 timings 计入直方图 (和当前请求的 Server-Timing)"""
+    durations = {k: v for k, v in timings.items() if k not in ('batch', 'cached') and not k.endswith('_bytes')}
+    observe_stages(durations, {k[:-6]: v for k, v in timings.items() if k.endswith('_bytes')})
+
+def error_text(e):
+    return str(e) or type(e).__name__
+
+def _chunks(sources, size):
+    items = iter(sources)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk: return
+        yield chunk
+
+def run_batch(mode, sources, params, load=None):
+    """并行处理 sources=[(文件名, 字节, 内容摘要)]，按输入顺序产出 (文件名, 输出名, 输出字节, 错误, 耗时)。
+    结果缓存命中的文件直接产出，只把未命中的交给进程池。
+    给定 load 时 sources 的第二项是 load 读出字节用的句柄 (如文件路径)，摘要必须已知，字节按进程池窗口逐个读入"""
+    if load is None: sources, keys = source_keys(mode, sources, params)
+    else: keys = [result_key(digest, mode, params) for _, _, digest in sources]
+    hits = [result_cache.get(key) for key in keys]
+    misses = (s for s, hit in zip(sources, hits) if hit is None)
+    if load is not None: misses = ((name, load(ref), digest) for name, ref, digest in misses)
+    computed = run_uncached(mode, misses, params)
+    try:
+        for (filename, _, _), key, hit in zip(sources, keys, hits):
+            if hit is not None:
+                yield filename, cached_name(filename, hit[0]), hit[1], None, {'cached': 1}
+                continue
+            result = next(computed)
+            observe_timings(result[4])
+            if not result[3]: result_cache.put(key, os.path.splitext(result[1])[1], result[2])
+            yield result
+    finally:
+        computed.close()
+
+def run_uncached(mode, sources, params):
+    """不查结果缓存的并行处理；sources 可以是惰性的迭代器，只按窗口大小往前读"""
+    size = matting_chunk_size() if mode == 'matting' else 1
+    window = max_parallel(mode, size)
+    chunks = _chunks(sources, size)
+    # 只有单进程配置才在调用线程里直接处理；多 worker 时即使窗口为 1 也交给进程池，不占用 web 进程
+    if PROCESS_WORKERS <= 1:
+        for chunk in chunks: yield from process_chunk(mode, chunk, params)
+        return
+    pending = deque()
+    try:
+        yield from _run_window(mode, chunks, params, window, pending)
+    finally:
+        # 客户端中途断开时取消还没开始的任务
+        for _, future in pending: future.cancel()
+
+def _run_window(mode, chunks, params, window, pending):
+    while True:
+        # 同时在跑的任务数不超过内存预算允许的窗口，结果仍按输入顺序返回
+        while len(pending) < window:
+            chunk = next(chunks, None)
+            if chunk is None: break
+            try: future = get_pool().submit(process_chunk, mode, chunk, params)
+            except BrokenProcessPool:
+                reset_pool()
+                future = get_pool().submit(process_chunk, mode, chunk, params)
+            pending.append(([filename for filename, _, _ in chunk], future))
+        if not pending: return
+        filenames, future = pending.popleft()
+        try:
+            yield from future.result()
+        except BrokenProcessPool:
+            # worker 被杀（通常是 OOM）：重建进程池，这一组文件记为失败
+            reset_pool()
+            for filename in filenames: yield filename, None, None, 'worker 进程异常退出', {}
+        except Exception as e:
+            for filename in filenames: yield filename, None, None, error_text(e), {}
+
+def unique_name(name, used):
+    base, ext = os.path.splitext(name)
+    n = 2
+    while name in used:
+        name = f"{base} ({n}){ext}"
+        n += 1
+    used.add(name)
+    return name
+
+class ZipStream:
+    """只追加的写入缓冲：zipfile 写入的字节被生成器取走后立刻发给客户端 (不可 seek，zipfile 会改用数据描述符)"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip(results, errors=None):
+    """边处理边打包：每处理完一个文件就写入 ZIP 并产出字节块，不落盘"""
+    errors = list(errors or [])
+    used_names = set()
+    buf = ZipStream()
+    with zipfile.ZipFile(buf, 'w') as zipf:
+        for filename, out_name, out_data, error, _ in results:
+            if error:
+                errors.append(f"{filename}: {error}")
+                continue
+            # PNG 本身已压缩，只对 SVG 做 deflate
+            compress = zipfile.ZIP_DEFLATED if out_name.lower().endswith('.svg') else zipfile.ZIP_STORED
+            with stage('zip'):
+                zipf.writestr(unique_name(out_name, used_names), out_data, compress_type=compress)
+                chunk = buf.take()
+            add_bytes('zip', len(chunk))
+            yield chunk
+        if errors: zipf.writestr('errors.txt', "\n".join(errors) + "\n", compress_type=zipfile.ZIP_DEFLATED)
+    yield buf.take()
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+import gen_bottle_mask_4 as core
+
+# 性能基准：在本地生成合成语料 (瓶子 SVG / 多分辨率 RGBA PNG / 带噪声的照片)，逐个函数、逐组参数测
+# 耗时、吞吐量和峰值内存，结果可输出为 JSON 并与上一次结果对比
+SEED = 20240601
+BOTTLE_SEGMENTS = 96
+
+def bottle_outline(cx, top, width, height, rng, segments=BOTTLE_SEGMENTS):
+    """瓶子轮廓：瓶身 + 瓶肩 + 瓶颈，左右对称，加一点抖动，返回闭合多边形顶点 (segments, 2)"""
+    t = np.linspace(0, 1, segments // 2)
+    neck, shoulder = 0.18, 0.35
+    half = np.where(t < neck, 0.18, np.where(t < shoulder, 0.18 + 0.32 * (1 - np.cos(np.pi * (t - neck) / (shoulder - neck))) / 2, 0.5))
+    half = half * width * (1 + rng.normal(0, 0.004, len(t)))
+    y = top + t * height
+    right = np.column_stack((cx + half, y))
+    left = np.column_stack((cx - half[::-1], y[::-1]))
+    return np.vstack((right, left))
+
+def cubic_path_d(points):
+    """用 Catmull-Rom 把顶点串成全是三次贝塞尔的闭合路径"""
+    p = np.asarray(points)
+    prev, nxt, nxt2 = np.roll(p, 1, 0), np.roll(p, -1, 0), np.roll(p, -2, 0)
+    c1 = p + (nxt - prev) / 6
+    c2 = nxt - (nxt2 - p) / 6
+    parts = [f"M{p[0][0]:.2f},{p[0][1]:.2f}"]
+    for a, b, e in zip(c1, c2, nxt):
+        parts.append(f"C{a[0]:.2f},{a[1]:.2f} {b[0]:.2f},{b[1]:.2f} {e[0]:.2f},{e[1]:.2f}")
+    return " ".join(parts) + "Z"
+
+def make_bottle_svg(path, count, rng):
+    cols = int(np.ceil(np.sqrt(count)))
+    cell = 220
+    size = cols * cell
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}">']
+    for i in range(count):
+        cx, top = (i % cols + 0.5) * cell, (i // cols) * cell + 10
+        outline = bottle_outline(cx, top, 120, 200, rng)
+        # 瓶身上的标签作为内孔，检验 evenodd 子路径
+        label = bottle_outline(cx, top + 110, 60, 50, rng, 32)
+        lines.append(f'<path d="{cubic_path_d(outline)} {cubic_path_d(label)}" fill="black" fill-rule="evenodd"/>')
+    lines.append('</svg>')
+    with open(path, 'w') as f: f.write("\n".join(lines))
+    return count * (BOTTLE_SEGMENTS + 32)
+
+def make_bottle_png(path, edge, rng):
+    """RGBA 瓶子剪影：4 倍超采样后缩小得到抗锯齿边缘，颜色带渐变"""
+    ss = 4 if edge <= 2048 else 2
+    w, h = edge, int(edge * 0.75)
+    mask = Image.new("L", (w * ss, h * ss), 0)
+    draw = ImageDraw.Draw(mask)
+    for i in range(3):
+        outline = bottle_outline((0.2 + 0.3 * i) * w * ss, 0.08 * h * ss, 0.22 * w * ss, 0.84 * h * ss, rng)
+        draw.polygon([tuple(p) for p in outline], fill=255)
+    mask = mask.resize((w, h), Image.LANCZOS)
+    gradient = np.linspace(40, 220, w, dtype=np.uint8)
+    rgb = np.dstack((np.tile(gradient, (h, 1)), np.full((h, w), 90, np.uint8), np.tile(gradient[::-1], (h, 1))))
+    img = Image.fromarray(rgb).convert("RGBA")
+    img.putalpha(mask)
+    img.save(path, compress_level=1)
+    return w * h
+
+def make_noisy_photo(path, edge, rng):
+    """给 Otsu 阈值用的"照片"：浅色背景上的深色瓶子和随机斑点，再加高斯噪声和轻微模糊"""
+    w, h = edge, int(edge * 0.75)
+    img = Image.new("L", (w, h), 210)
+    draw = ImageDraw.Draw(img)
+    for i in range(3):
+        outline = bottle_outline((0.2 + 0.3 * i) * w, 0.08 * h, 0.22 * w, 0.84 * h, rng)
+        draw.polygon([tuple(p) for p in outline], fill=50)
+    for _ in range(200):
+        x, y, r = rng.integers(0, w), rng.integers(0, h), rng.integers(2, max(3, edge // 80))
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=int(rng.integers(0, 90)))
+    arr = np.asarray(img.filter(ImageFilter.GaussianBlur(1.5)), dtype=np.float32)
+    arr += rng.normal(0, 18, arr.shape)
+    Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8)).convert("RGB").save(path, quality=92)
+    return w * h
+
+def make_corpus(directory, quick=False):
+    """生成语料，返回 {名称: (路径, 规模, 单位)}；同一个种子每次生成的内容相同"""
+    rng = np.random.default_rng(SEED)
+    os.makedirs(directory, exist_ok=True)
+    corpus = {}
+    for count in ((4, 40) if quick else (4, 100, 400)):
+        name = f"bottles_{count}.svg"
+        corpus[name] = (os.path.join(directory, name), make_bottle_svg(os.path.join(directory, name), count, rng), 'seg')
+    for edge in ((512, 2048) if quick else (512, 2048, 6000)):
+        name = f"bottle_{edge}.png"
+        corpus[name] = (os.path.join(directory, name), make_bottle_png(os.path.join(directory, name), edge, rng), 'px')
+    for edge in ((1024,) if quick else (1024, 3000)):
+        name = f"photo_{edge}.jpg"
+        corpus[name] = (os.path.join(directory, name), make_noisy_photo(os.path.join(directory, name), edge, rng), 'px')
+    return corpus
+
+def clear_caches():
+    for cache in (core.mask_cache, core.contour_cache, core.field_cache): cache.clear()
+
+def matting_mask(path):
+    """有可用模型时测真实推理 (模型在计时前加载并预热)；否则用 PNG 自带的 alpha 作为预先算好的蒙版，只测后处理"""
+    try:
+        core.preload_models([core.MATTING_MODEL], warmup=True)
+        return None
+    except Exception:
+        return Image.open(path).getchannel('A')
+
+def build_cases(corpus, quick=False):
+    """基准用例：(用例名, 输入名, 调用函数(输入路径, 输出路径), 参数)"""
+    cases = []
+    svgs = [k for k in corpus if k.endswith('.svg')]
+    pngs = [k for k in corpus if k.endswith('.png')]
+    photos = [k for k in corpus if k.endswith('.jpg')]
+    for name in svgs:
+        for shrink in (2, 8, 20):
+            cases.append(('process_bottle_svg', name, lambda src, out, s=shrink: core.process_bottle_svg(src, out, shrink_px=s),
+                          {'shrink_px': shrink}))
+    for name in pngs:
+        for shrink in (2, 8, 50):
+            cases.append(('process_raster_image', name,
+                          lambda src, out, s=shrink: core.process_raster_image(src, out, shrink_px=s), {'shrink_px': shrink}))
+    for name in photos + pngs[:1]:
+        for smooth, radius in ((2, 0), (8, 0), (2, 4), (8, 4)):
+            cases.append(('convert_bitmap_to_svg', name,
+                          lambda src, out, s=smooth, r=radius: core.convert_bitmap_to_svg(src, out, smoothness=s, corner_radius=r),
+                          {'smoothness': smooth, 'corner_radius': radius}))
+    for name in pngs:
+        for width in ((4, 50) if quick else (4, 20, 50)):
+            for pos in ('outer', 'inner', 'center'):
+                def stroke(src, out, w=width, p=pos):
+                    core.apply_stroke(Image.open(src).convert("RGBA"), w, '#FFFFFF', p).save(out, compress_level=1)
+                    return out
+                cases.append(('apply_stroke', name, stroke, {'width': width, 'position': pos}))
+    for name in pngs[:2] if quick else pngs:
+        mask = matting_mask(corpus[name][0])
+        for shift, width in ((0, 0), (4, 10), (-4, 50)):
+            def matting(src, out, s=shift, w=width, m=mask):
+                img = Image.open(src).convert("RGB")
+                return core.remove_background_ai(img, out, 10, s, w, '#FFFFFF', 'outer', content_key=src, mask=m)
+            cases.append(('remove_background_ai', name, matting, {'edge_shift': shift, 'stroke_width': width}))
+        if mask is not None: continue
+        # 有真实模型时再测量化模型和 fast 档的端到端耗时 (每次运行前清缓存，包含推理)
+        for model, speed in MATTING_VARIANTS[1:]:
+            def matting(src, out, md=model, sp=speed):
+                img = Image.open(src).convert("RGB")
+                return core.remove_background_ai(img, out, content_key=src, model=md, speed=sp)
+            cases.append(('remove_background_ai', name, matting, {'model': model, 'speed': speed}))
+    return cases
+
+# 抠图精度对比：第一项为基准 (float 模型 + 标准档)
+MATTING_VARIANTS = tuple((core.MATTING_MODEL + suffix, speed)
+                         for speed in ('normal', 'fast') for suffix in ('', core.INT8_SUFFIX))
+
+def matting_accuracy(corpus, repeat):
+    """各 (模型, 速度档) 的蒙版与 float 模型标准档的差异：平均绝对误差 (0~255)、alpha>127 二值化后的 IoU；
+    同时给出与语料真实 alpha 的 IoU、推理耗时、推理峰值内存和加载模型增加的常驻内存"""
+    results, load_mb = [], {}
+    for model, _ in MATTING_VARIANTS:
+        if model in load_mb: continue
+        release_memory()
+        base = rss_mb('VmRSS')
+        core.preload_models([model], warmup=True)
+        load_mb[model] = rss_mb('VmRSS') - base
+    print(f"\n{'抠图精度':<56} {'中位(s)':>9} {'峰值内存':>10} {'模型内存':>9} {'MAE':>7} {'IoU':>8} {'真值IoU':>8}")
+    for name, (path, amount, unit) in corpus.items():
+        if not name.endswith('.png'): continue
+        source = Image.open(path)
+        truth = np.asarray(source.getchannel('A')) > 127
+        img = source.convert("RGB")
+        reference = None
+        for model, speed in MATTING_VARIANTS:
+            times, peaks = [], []
+            for _ in range(repeat):
+                release_memory()
+                reset_peak_rss()
+                base = rss_mb('VmRSS')
+                t = time.perf_counter()
+                mask = core.predict_masks([img], model, speed)[0]
+                times.append(time.perf_counter() - t)
+                peaks.append(rss_mb('VmHWM') - base)
+            m = np.asarray(mask, dtype=np.float32)
+            if reference is None: reference = m
+            binary, ref = m > 127, reference > 127
+            iou = (binary & ref).sum() / max((binary | ref).sum(), 1)
+            truth_iou = (binary & truth).sum() / max((binary | truth).sum(), 1)
+            median = statistics.median(times)
+            case_id = f"matting_accuracy[{name}] model={model} speed={speed}"
+            results.append({'id': case_id, 'input': name, 'model': model, 'speed': speed, 'median_s': round(median, 5),
+                            'peak_rss_mb': round(max(peaks), 1), 'model_rss_mb': round(load_mb[model], 1),
+                            'mae': round(float(np.abs(m - reference).mean()), 3), 'iou': round(float(iou), 5),
+                            'truth_iou': round(float(truth_iou), 5)})
+            r = results[-1]
+            print(f"{case_id:<56} {median:>9.4f} {r['peak_rss_mb']:>8.1f}MB {r['model_rss_mb']:>7.1f}MB "
+                  f"{r['mae']:>7.3f} {r['iou']:>8.5f} {r['truth_iou']:>8.5f}")
+    return results
+
+def rss_mb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def reset_peak_rss():
+    """Linux 上把 VmHWM 重置为当前 RSS，这样每个用例的峰值互不影响"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        return True
+    except OSError:
+        return False
+
+def release_memory():
+    """跑用例前把已释放的内存还给系统，否则 RSS 基线偏高、后续运行的峰值增量测不出来"""
+    import gc
+    import ctypes
+    gc.collect()
+    try: ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError): pass
+
+def run_case(func, src, out_dir, repeat, warm):
+    times, peaks = [], []
+    for i in range(repeat):
+        if not warm: clear_caches()
+        out = os.path.join(out_dir, f"out_{i}{os.path.splitext(src)[1]}")
+        release_memory()
+        reset_peak_rss()
+        base = rss_mb('VmRSS')
+        t = time.perf_counter()
+        func(src, out)
+        times.append(time.perf_counter() - t)
+        peaks.append(rss_mb('VmHWM') - base)
+    return times, max(peaks)
+
+def environment():
+    try: commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError: commit = ''
+    import PIL, cv2, shapely
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'pillow': PIL.__version__, 'opencv': cv2.__version__,
+            'shapely': shapely.__version__, 'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def compare(results, baseline_path, threshold):
+    """与基线对比中位耗时，变慢超过 threshold 的用例记为回退，返回回退数量"""
+    with open(baseline_path) as f: baseline = {r['id']: r for r in json.load(f)['results']}
+    regressions = 0
+    print(f"\n{'用例':<70} {'基线(s)':>9} {'本次(s)':>9} {'变化':>8}")
+    for r in results:
+        old = baseline.get(r['id'])
+        if old is None: continue
+        ratio = r['median_s'] / old['median_s'] if old['median_s'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- 变慢'
+            regressions += 1
+        elif ratio < 1 - threshold: flag = '  (变快)'
+        print(f"{r['id']:<70} {old['median_s']:>9.4f} {r['median_s']:>9.4f} {ratio - 1:>+8.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='gen_bottle_mask_4 性能基准')
+    parser.add_argument('--quick', action='store_true', help='小语料，快速跑一遍')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例重复次数 (取中位数)')
+    parser.add_argument('--filter', default='', help='只跑用例名或输入名包含该字符串的用例')
+    parser.add_argument('--warm', action='store_true', help='不在每次运行前清空内部缓存')
+    parser.add_argument('--corpus', default='', help='语料目录 (默认临时目录，跑完删除)')
+    parser.add_argument('--json', dest='json_path', default='', help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', default='', help='与之前保存的 JSON 结果对比')
+    parser.add_argument('--threshold', type=float, default=0.15, help='对比时判定为回退的变慢比例')
+    parser.add_argument('--accuracy', action='store_true', help='对比 int8 量化模型 / fast 档与 float 模型的蒙版差异 (需要可用的模型)')
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus or tempfile.mkdtemp(prefix='bench_corpus_')
+    out_dir = tempfile.mkdtemp(prefix='bench_out_')
+    try:
+        corpus = make_corpus(corpus_dir, args.quick)
+        cases = [c for c in build_cases(corpus, args.quick) if args.filter in c[0] or args.filter in c[1]]
+        results = []
+        warmed = set()
+        print(f"{'用例':<70} {'中位(s)':>9} {'最快(s)':>9} {'吞吐':>14} {'峰值内存':>10}")
+        for name, input_name, func, params in cases:
+            path, amount, unit = corpus[input_name]
+            # 每个函数 (抠图再按模型/速度档) 先不计时跑一次，排除延迟导入、模型加载和 int8 首次量化的开销
+            warm_key = (name, params.get('model'), params.get('speed'))
+            if warm_key not in warmed:
+                func(path, os.path.join(out_dir, 'warmup' + os.path.splitext(path)[1]))
+                warmed.add(warm_key)
+            times, peak = run_case(func, path, out_dir, args.repeat, args.warm)
+            median = statistics.median(times)
+            scale, unit_label = (1e6, 'MP/s') if unit == 'px' else (1, 'seg/s')
+            case_id = f"{name}[{input_name}]" + "".join(f" {k}={v}" for k, v in params.items())
+            results.append({'id': case_id, 'function': name, 'input': input_name, 'params': params,
+                            'size': amount, 'unit': unit, 'times_s': [round(t, 5) for t in times],
+                            'median_s': round(median, 5), 'min_s': round(min(times), 5),
+                            'throughput': round(amount / scale / median, 3) if median else None,
+                            'throughput_unit': unit_label, 'peak_rss_mb': round(peak, 1)})
+            print(f"{case_id:<70} {median:>9.4f} {min(times):>9.4f} {amount / scale / median:>9.2f} {unit_label:<4} {peak:>8.1f}MB")
+        report = {'environment': environment(), 'repeat': args.repeat, 'quick': args.quick, 'warm': args.warm,
+                  'results': results}
+        if args.accuracy:
+            try: report['accuracy'] = matting_accuracy(corpus, args.repeat)
+            except Exception as e: print(f"\n跳过抠图精度对比 (模型不可用): {e}")
+        if args.json_path:
+            with open(args.json_path, 'w') as f: json.dump(report, f, ensure_ascii=False, indent=1)
+        if args.compare and compare(results, args.compare, args.threshold): sys.exit(1)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if not args.corpus: shutil.rmtree(corpus_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
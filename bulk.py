@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+from collections import deque
+import batch
+from result_cache import result_key, DEFAULTS
+from gen_bottle_mask_4 import (RASTER_ENCODINGS, EXPORT_ENCODING, MATTING_MODEL, MATTING_MODELS, MATTING_SPEED,
+                               MATTING_SPEEDS, parse_steps)
+
+# 命令行批处理：遍历输入目录，用 batch 的进程池并行处理，按原目录结构写到输出目录，不经过 web 层。
+# 输出目录下的清单记录每个文件的内容摘要、参数和结果，中断后重跑会跳过已完成且没有变化的文件
+INPUT_EXTENSIONS = {'.svg', '.png', '.jpg', '.jpeg', '.webp', '.bmp'}
+MANIFEST_NAME = '.manifest.jsonl'
+
+class Manifest:
+    """追加写的 JSON Lines 清单：每处理完一个文件写一行并立即 flush，同一路径以最后一行为准"""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try: entry = json.loads(line)
+                    except ValueError: continue  # 中断时写了一半的行
+                    self.entries[entry['path']] = entry
+        self._fp = open(path, 'a', encoding='utf-8')
+
+    def record(self, entry):
+        self.entries[entry['path']] = entry
+        self._fp.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._fp.flush()
+
+    def close(self, compact=True):
+        """正常结束时把清单压缩成每个文件一行"""
+        self._fp.close()
+        if not compact: return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values(): f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp, self.path)
+
+def walk_inputs(input_dir, skip_dir=None):
+    """按路径排序产出相对路径；跳过隐藏目录和位于输入目录内的输出目录"""
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and os.path.join(root, d) != skip_dir)
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in INPUT_EXTENSIONS:
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f: f.write(data)
+    os.replace(tmp, path)
+
+def up_to_date(entry, key, output_dir):
+    return (entry is not None and entry.get('status') == 'done' and entry.get('key') == key
+            and os.path.exists(os.path.join(output_dir, entry['output'])))
+
+def run(input_dir, output_dir, mode, params, force=False, quiet=False):
+    """处理整棵目录树，返回 {'done', 'skipped', 'failed'} 计数"""
+    input_dir, output_dir = os.path.abspath(input_dir), os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+    encoding = params.get('encoding')
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    pending = deque()
+    # 输出名 -> 源文件：a.jpg 和 a.png 都会输出 a.png，被别的源文件占用的名字改为带上源扩展名 (a.png.png)
+    claimed = {entry['output']: path for path, entry in manifest.entries.items() if entry.get('output')}
+
+    def sources():
+        # 惰性读取：进程池只按窗口大小往前取，内存里最多留窗口内的文件内容
+        for rel in walk_inputs(input_dir, output_dir):
+            path = os.path.join(input_dir, rel)
+            st = os.stat(path)
+            entry = None if force else manifest.entries.get(rel)
+            # 大小和修改时间都没变时不必重新读文件算摘要
+            if (entry and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns
+                    and up_to_date(entry, result_key(entry['digest'], mode, params, encoding=encoding), output_dir)):
+                counts['skipped'] += 1
+                continue
+            with open(path, 'rb') as f: data = f.read()
+            digest = hashlib.sha1(data).hexdigest()
+            key = result_key(digest, mode, params, encoding=encoding)
+            if up_to_date(entry, key, output_dir):
+                # 只是被 touch 过，内容没变
+                manifest.record(dict(entry, size=st.st_size, mtime_ns=st.st_mtime_ns))
+                counts['skipped'] += 1
+                continue
+            pending.append((rel, st, digest, key))
+            yield os.path.basename(rel), data, digest
+
+    started = time.perf_counter()
+    results = batch.run_uncached(mode, sources(), params)
+    completed = False
+    try:
+        for filename, out_name, out_data, error, timings in results:
+            rel, st, digest, key = pending.popleft()
+            entry = {'path': rel, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': digest, 'key': key,
+                     'mode': mode, 'params': params}
+            if error:
+                counts['failed'] += 1
+                manifest.record(dict(entry, status='failed', error=error, output=None))
+                print(f"失败 {rel}: {error}", file=sys.stderr)
+                continue
+            out_rel = os.path.join(os.path.dirname(rel), out_name)
+            if claimed.get(out_rel, rel) != rel:
+                base, ext = os.path.splitext(out_rel)
+                out_rel = base + os.path.splitext(rel)[1] + ext
+            claimed[out_rel] = rel
+            write_atomic(os.path.join(output_dir, out_rel), out_data)
+            manifest.record(dict(entry, status='done', output=out_rel, bytes=len(out_data),
+                                 seconds=round(timings.get('process', 0), 4)))
+            counts['done'] += 1
+            if not quiet: print(f"{rel} -> {out_rel} ({timings.get('process', 0):.2f}s)")
+        completed = True
+    finally:
+        results.close()
+        manifest.close(compact=completed)
+    elapsed = time.perf_counter() - started
+    rate = counts['done'] / elapsed if elapsed > 0 else 0
+    print(f"完成 {counts['done']}，跳过 {counts['skipped']}，失败 {counts['failed']}，"
+          f"耗时 {elapsed:.1f}s ({rate:.2f} 个/秒)")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='按目录批量处理瓶子素材 (可中断续跑)')
+    parser.add_argument('input_dir', help='输入目录 (递归处理 svg/png/jpg/webp/bmp)')
+    parser.add_argument('output_dir', help='输出目录，保持与输入相同的目录结构')
+    parser.add_argument('--mode', choices=('shrink', 'vectorize', 'matting'), default='shrink')
+    parser.add_argument('--indent', type=int, default=DEFAULTS['indent'], help='内缩像素 (shrink)')
+    parser.add_argument('--smoothness', type=int, default=DEFAULTS['smoothness'], help='平滑度 (vectorize)')
+    parser.add_argument('--radius', type=float, default=DEFAULTS['radius'], help='圆角半径 (vectorize)')
+    parser.add_argument('--color', default=DEFAULTS['color'], help='填充色 (vectorize)')
+    parser.add_argument('--min-area', type=float, default=DEFAULTS['min_area'], help='最小轮廓面积 (vectorize)')
+    parser.add_argument('--threshold', type=int, default=DEFAULTS['threshold'], help='alpha 阈值 (matting)')
+    parser.add_argument('--shift', type=int, default=DEFAULTS['shift'], help='修边像素 (matting)')
+    parser.add_argument('--stroke-width', type=int, default=DEFAULTS['stroke_width'], help='描边宽度 (matting)')
+    parser.add_argument('--stroke-color', default=DEFAULTS['stroke_color'], help='描边颜色 (matting)')
+    parser.add_argument('--stroke-pos', choices=('outer', 'inner', 'center'), default=DEFAULTS['stroke_pos'])
+    parser.add_argument('--model', choices=MATTING_MODELS, default=MATTING_MODEL, help='抠图模型 (-int8 为量化版本)')
+    parser.add_argument('--speed', choices=MATTING_SPEEDS, default=MATTING_SPEED, help='抠图速度档 (matting)')
+    parser.add_argument('--steps', default='', help='流水线步骤 (JSON 列表，如 [{"mode":"matting"},{"mode":"vectorize"}])，'
+                                                    '设置后忽略 --mode')
+    parser.add_argument('--encoding', choices=sorted(RASTER_ENCODINGS), default=EXPORT_ENCODING, help='位图输出编码')
+    parser.add_argument('--workers', type=int, default=0, help='进程数 (默认 PROCESS_WORKERS / CPU 核数)')
+    parser.add_argument('--memory-mb', type=int, default=0, help='进程池总内存预算 (默认 PROCESS_MEM_BUDGET_MB)')
+    parser.add_argument('--force', action='store_true', help='忽略清单，全部重新处理')
+    parser.add_argument('--quiet', action='store_true', help='只输出失败的文件和汇总')
+    args = parser.parse_args()
+
+    if args.workers > 0: batch.PROCESS_WORKERS = args.workers
+    if args.memory_mb > 0: batch.PROCESS_MEM_BUDGET_MB = args.memory_mb
+    params = {'indent': args.indent, 'smoothness': args.smoothness, 'radius': args.radius, 'color': args.color,
+              'min_area': args.min_area, 'threshold': args.threshold, 'shift': args.shift,
+              'stroke_width': args.stroke_width, 'stroke_color': args.stroke_color, 'stroke_pos': args.stroke_pos,
+              'model': args.model, 'speed': args.speed, 'encoding': args.encoding}
+    mode = args.mode
+    if args.steps:
+        try: params['steps'] = parse_steps(args.steps)
+        except ValueError as e: parser.error(f'--steps: {e}')
+        mode = 'pipeline'
+    try:
+        counts = run(args.input_dir, args.output_dir, mode, params, args.force, args.quiet)
+    except KeyboardInterrupt:
+        print('已中断，已完成的文件记录在清单里，重新运行同一命令即可继续', file=sys.stderr)
+        sys.exit(130)
+    finally:
+        batch.reset_pool()
+    if counts['failed']: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,456 @@
+import io
 import os
-import cv2
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
 import numpy as np
-from svgpathtools import svg2paths2, wsvg, parse_path
-from shapely.geometry import Polygon, MultiPolygon
-from PIL import Image, ImageFilter, ImageOps
-from rembg import remove, new_session
+from PIL import Image, ImageOps
+from svg_writer import open_svg, ring_d, rings_d, rounded_ring_d
+from metrics import stage, add_stage, add_bytes
+# cv2 / svgpathtools / shapely / rembg 较重，按模式在首次使用时再导入，只做 SVG 内缩的 worker 不必加载 onnxruntime
 
 # 【关键修改】使用 u2netp (轻量版) 适配 512MB 内存
-rembg_session = new_session("u2netp")
+MATTING_MODEL = os.environ.get('MATTING_MODEL', "u2netp")
+# 启动时预加载的模型 (逗号分隔)、是否做一次预热推理、onnxruntime 线程数 (0 = 由 onnxruntime 决定)
+MATTING_PRELOAD = [m.strip() for m in os.environ.get('MATTING_PRELOAD', '').split(',') if m.strip()]
+MATTING_WARMUP = os.environ.get('MATTING_WARMUP', '0') == '1'
+ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))
+ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 0))
+
+# u2net 系列的输入尺寸和归一化参数，与 rembg 各 session 的 predict 保持一致，用于批量推理
+U2NET_INPUT = ((320, 320), (0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+MODEL_INPUTS = {'u2netp': U2NET_INPUT, 'u2net': U2NET_INPUT, 'u2net_human_seg': U2NET_INPUT, 'silueta': U2NET_INPUT}
+# int8 量化模型：'<模型名>-int8' 为 rembg 模型的 int8 版本，由 float 模型生成并保存在 QUANTIZED_MODEL_DIR
+# (默认与 float 模型同目录，新版 rembg 只加载模型目录内的文件)，之后直接加载。
+# 量化依赖 onnx 包。部署时在构建阶段运行 quantize.py，并让 QUANTIZED_MODEL_DIR (或 rembg 模型目录) 指向运行时仍在的存储，
+# 或把 int8 模型写进 MATTING_PRELOAD 在 worker 启动时生成；否则第一个用到它的请求要等量化完成。
+# QUANTIZE_METHOD=static (默认) 用校准图确定激活范围，CPU 上走 int8 卷积；dynamic 只量化权重，
+# 卷积会变成 ConvInteger，在 onnxruntime CPU 上反而比 float 慢，只在看重模型体积时使用
+INT8_SUFFIX = '-int8'
+QUANTIZED_MODEL_DIR = os.environ.get('QUANTIZED_MODEL_DIR', '')
+QUANTIZE_METHOD = os.environ.get('QUANTIZE_METHOD', 'static')
+# 静态量化的校准素材目录 (不设置时用生成的合成图) 和最多使用的张数
+MATTING_CALIBRATION_DIR = os.environ.get('MATTING_CALIBRATION_DIR', '')
+CALIBRATION_IMAGES = int(os.environ.get('CALIBRATION_IMAGES', 16))
+# 允许按请求选择的模型 (逗号分隔)，默认是 MATTING_MODEL 和它的 int8 版本
+MATTING_MODELS = [m.strip() for m in os.environ.get('MATTING_MODELS', f'{MATTING_MODEL},{MATTING_MODEL}{INT8_SUFFIX}').split(',')
+                  if m.strip()]
+# 速度档：fast 用 FAST_INPUT_EDGE 的小输入推理，蒙版以原图为引导做导向滤波上采样。rembg 自带的 float 模型输入尺寸固定，
+# 小输入只对 -int8 模型生效 (量化时把输入高、宽改成可变)；float 模型的 fast 只换用更快的缩放和上采样
+MATTING_SPEEDS = ('normal', 'fast')
+MATTING_SPEED = os.environ.get('MATTING_SPEED', 'normal')
+FAST_INPUT_EDGE = int(os.environ.get('MATTING_FAST_INPUT', 192))
+# 导向滤波在最长边 GUIDED_EDGE 的中间尺寸上求系数，窗口半径 (px) 和正则项越小越贴合原图边缘
+GUIDED_EDGE = int(os.environ.get('MATTING_GUIDED_EDGE', 512))
+GUIDED_RADIUS = 8
+GUIDED_EPS = 1e-3
+# 批量推理每批张数 (0 = 按可用内存自动决定)，以及自动模式下每张图估算的推理内存 (MB)
+MATTING_BATCH_SIZE = int(os.environ.get('MATTING_BATCH_SIZE', 0))
+MATTING_BATCH_MAX = int(os.environ.get('MATTING_BATCH_MAX', 8))
+MATTING_IMAGE_MB = 80
+
+class ModelRegistry:
+    """抠图模型注册表：按需创建 rembg session，同一进程内每个模型只加载一次"""
+    def __init__(self):
+        self._sessions = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def _create(self, name):
+        import onnxruntime as ort
+        from rembg import new_session
+        opts = ort.SessionOptions()
+        if ORT_INTRA_OP_THREADS: opts.intra_op_num_threads = ORT_INTRA_OP_THREADS
+        if ORT_INTER_OP_THREADS: opts.inter_op_num_threads = ORT_INTER_OP_THREADS
+        kwargs = {}
+        if name.endswith(INT8_SUFFIX):
+            # 量化模型的预处理与 u2net 系列相同，用 rembg 的自定义模型 session 加载本地文件
+            name, kwargs = 'u2net_custom', {'model_path': quantize_model(base_model(name))}
+        try: return new_session(name, sess_opts=opts, **kwargs)
+        except TypeError: return new_session(name, **kwargs)  # 旧版 rembg 不接受 sess_opts
+
+    def get(self, name=MATTING_MODEL):
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is not None: return session
+            building = self._building.setdefault(name, threading.Lock())
+        # 加载 (int8 模型首次还要量化) 可能很慢：只锁这一个模型名，已加载的模型照常推理
+        with building:
+            with self._lock: session = self._sessions.get(name)
+            if session is None:
+                session = self._create(name)
+                with self._lock: self._sessions[name] = session
+            return session
+
+    def warmup(self, name=MATTING_MODEL):
+        # 先跑一次小图推理，把 onnxruntime 的首次分配/图优化挪到启动阶段
+        self.get(name).predict(Image.effect_noise((64, 64), 64).convert("RGB"))
+
+    def loaded(self):
+        with self._lock:
+            return list(self._sessions)
+
+model_registry = ModelRegistry()
+
+def base_model(name):
+    return name[:-len(INT8_SUFFIX)] if name.endswith(INT8_SUFFIX) else name
+
+def calibration_images(limit=CALIBRATION_IMAGES):
+    """静态量化的校准图：优先用 MATTING_CALIBRATION_DIR 里的真实素材，没有时生成浅色背景上的彩色物体 (固定种子)"""
+    if MATTING_CALIBRATION_DIR:
+        count = 0
+        for name in sorted(os.listdir(MATTING_CALIBRATION_DIR)):
+            if count >= limit: return
+            try: img = open_image(os.path.join(MATTING_CALIBRATION_DIR, name)).convert("RGB")
+            except (OSError, ValueError): continue
+            count += 1
+            yield img
+        if count: return
+    from PIL import ImageDraw, ImageFilter
+    rng = np.random.default_rng(0)
+    for _ in range(limit):
+        img = Image.new("RGB", (640, 640), tuple(int(v) for v in rng.integers(170, 256, 3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(int(rng.integers(1, 4))):
+            x, y = rng.integers(40, 600, 2)
+            w, h = rng.integers(60, 320, 2)
+            color = tuple(int(v) for v in rng.integers(0, 256, 3))
+            if rng.random() < 0.5: draw.ellipse((x - w // 2, y - h // 2, x + w // 2, y + h // 2), fill=color)
+            else: draw.rounded_rectangle((x - w // 2, y - h, x + w // 2, y + h), radius=int(w // 4), fill=color)
+        arr = np.asarray(img.filter(ImageFilter.GaussianBlur(1)), dtype=np.float32)
+        arr += rng.normal(0, 6, arr.shape)
+        yield Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+def flexible_input_model(source, path):
+    """把模型输入/输出的高、宽改成符号维度另存到 path，fast 档才能用更小的输入推理。
+    改完按 FAST_INPUT_EDGE 试跑一次，图里有写死尺寸的算子跑不通时返回 False (仍用原尺寸的模型)"""
+    import onnx
+    import onnxruntime as ort
+    model = onnx.load(source)
+    weights = {t.name for t in model.graph.initializer}
+    for value in list(model.graph.input) + list(model.graph.output):
+        dims = value.type.tensor_type.shape.dim
+        if value.name not in weights and len(dims) == 4: dims[2].dim_param, dims[3].dim_param = 'height', 'width'
+    # 中间张量推断出的形状是按原尺寸写死的，清掉让 onnxruntime 重新推断
+    del model.graph.value_info[:]
+    onnx.save(model, path)
+    try:
+        session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        probe = np.zeros((1, 3, FAST_INPUT_EDGE, FAST_INPUT_EDGE), np.float32)
+        out = session.run(None, {session.get_inputs()[0].name: probe})[0]
+        return out.shape[2:] == probe.shape[2:]
+    except Exception:
+        return False
+
+def quantize_model(name, method=None):
+    """把 rembg 的 u2net 系列 float 模型量化成 int8 并保存到本地，已存在时直接返回路径；权重约缩小到 1/4。
+    量化前把输入高、宽改成可变的，fast 档用 FAST_INPUT_EDGE 的小输入推理"""
+    method = method or QUANTIZE_METHOD
+    from rembg.sessions import sessions_class
+    session_class = next((sc for sc in sessions_class if sc.name() == name), None)
+    if session_class is None or name not in MODEL_INPUTS: raise ValueError(f'{name} 不支持 int8 量化')
+    source = session_class.download_models()
+    directory = QUANTIZED_MODEL_DIR or os.path.dirname(source)
+    # 文件名里的 hw 表示输入高、宽可变，旧版固定尺寸的量化模型不会被复用
+    path = os.path.join(directory, f'{name}.{method}.hw-int8.onnx')
+    if os.path.exists(path): return path
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, CalibrationDataReader, QuantFormat, QuantType
+    os.makedirs(directory, exist_ok=True)
+    # 先写临时文件再改名，多个进程同时生成时不会读到写了一半的模型
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp', suffix='.onnx')
+    os.close(fd)
+    flexible = tmp[:-len('.onnx')] + '.hw.onnx'
+    try:
+        if flexible_input_model(source, flexible): source = flexible
+        if method == 'dynamic':
+            # CPU 上的 ConvInteger 只支持 uint8 权重
+            quantize_dynamic(source, tmp, weight_type=QuantType.QUInt8)
+        else:
+            size, mean, std = MODEL_INPUTS[name]
+            input_name = ort.InferenceSession(source, providers=['CPUExecutionProvider']).get_inputs()[0].name
+            feeds = ({input_name: model_input(img, size, mean, std)[None]} for img in calibration_images())
+
+            class Calibration(CalibrationDataReader):
+                def get_next(self): return next(feeds, None)
+
+            # QDQ 格式 + 按通道量化权重：onnxruntime 会融合成 int8 卷积，精度损失比按张量量化小
+            quantize_static(source, tmp, Calibration(), quant_format=QuantFormat.QDQ, per_channel=True,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        os.replace(tmp, path)
+    finally:
+        for leftover in (tmp, flexible):
+            if os.path.exists(leftover): os.remove(leftover)
+    return path
+
+def matting_model(name=None):
+    """请求里选的模型不在 MATTING_MODELS 中时退回默认模型"""
+    return name if name in MATTING_MODELS else MATTING_MODEL
+
+def matting_speed(speed=None):
+    return speed if speed in MATTING_SPEEDS else MATTING_SPEED
+
+def preload_models(names=None, warmup=None):
+    names = MATTING_PRELOAD if names is None else names
+    warmup = MATTING_WARMUP if warmup is None else warmup
+    for name in names:
+        model_registry.get(name)
+        if warmup: model_registry.warmup(name)
+
+# 预览代理图最长边 (px)，/process 导出始终使用原图
+PREVIEW_MAX_EDGE = int(os.environ.get('PREVIEW_MAX_EDGE', 1024))
+PIXEL_PARAMS = ('indent', 'shift', 'stroke_width')
+
+class LRUCache:
+    """按占用字节数限额的 LRU 缓存（线程安全），附带命中/未命中计数"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.max_bytes: return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self.size -= old[1]
+            self._data[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, n) = self._data.popitem(last=False)
+                self.size -= n
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._data),
+                    'bytes': self.size, 'max_bytes': self.max_bytes}
+
+# 抠图蒙版缓存：只调阈值/修边/描边时跳过 AI 推理 (默认 16MB，可用 MASK_CACHE_MB 调整)
+mask_cache = LRUCache(int(os.environ.get('MASK_CACHE_MB', 16)) * 1024 * 1024)
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''): h.update(chunk)
+    return h.hexdigest()
+
+def open_image(src):
+    """唯一的解码入口：src 可以是文件路径/文件对象、编码后的字节、NumPy 数组 (RGB/RGBA 通道顺序) 或 PIL 图像"""
+    if isinstance(src, Image.Image): return src
+    if isinstance(src, (bytes, bytearray, memoryview)): return Image.open(io.BytesIO(src))
+    if isinstance(src, np.ndarray): return Image.fromarray(src)
+    return Image.open(src)
+
+def is_svg_source(src):
+    """路径按扩展名判断；内存中的字节看开头是不是 XML (位图格式都不以 '<' 开头)"""
+    if isinstance(src, str): return src.lower().endswith('.svg')
+    if isinstance(src, (bytes, bytearray, memoryview)): return bytes(src[:64]).lstrip().startswith(b'<')
+    return False
+
+def upright(img):
+    """按 EXIF 方向摆正；没有旋转时直接返回原图，不复制整张图"""
+    return ImageOps.exif_transpose(img) if img.getexif().get(0x0112, 1) != 1 else img
+
+def content_digest(src):
+    if isinstance(src, Image.Image):
+        h = hashlib.sha1(f"{src.mode}{src.size}".encode())
+        h.update(src.tobytes())
+        return h.hexdigest()
+    if isinstance(src, np.ndarray):
+        h = hashlib.sha1(f"{src.dtype}{src.shape}".encode())
+        h.update(np.ascontiguousarray(src).data)
+        return h.hexdigest()
+    if isinstance(src, (bytes, bytearray, memoryview)): return hashlib.sha1(src).hexdigest()
+    if isinstance(src, io.BytesIO): return hashlib.sha1(src.getbuffer()).hexdigest()
+    return file_digest(src)
+
+def open_proxy_image(src, max_edge=PREVIEW_MAX_EDGE):
+    """解码缩小后的预览代理图，返回 (图像, 缩放比例)。JPEG 通过 draft 直接按 1/2~1/8 解码"""
+    img = open_image(src)
+    w, h = img.size
+    if not max_edge or max(w, h) <= max_edge: return img, 1.0
+    scale = max_edge / max(w, h)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if not isinstance(src, Image.Image): img.draft(img.mode, size)
+    if img.mode == 'P': img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    elif img.mode == '1': img = img.convert('L')
+    proxy = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    return proxy, size[0] / w
+
+def scale_params(params, scale):
+    """把像素类参数换算到代理图尺寸，保证预览和原图导出观感一致"""
+    if scale == 1: return dict(params)
+    scaled = dict(params)
+    for key in PIXEL_PARAMS:
+        v = params.get(key, 0)
+        if v: scaled[key] = max(1, round(v * scale)) if v > 0 else min(-1, round(v * scale))
+    if params.get('radius'): scaled['radius'] = params['radius'] * scale
+    scaled['min_area'] = params.get('min_area', 50) * scale * scale
+    if params.get('steps'): scaled['steps'] = [scale_params(step, scale) for step in params['steps']]
+    return scaled
+
+def threshold_channel(img):
+    """矢量化用的单通道：有透明通道时取 alpha，否则取灰度，返回 (数组, 是否 alpha)。直接从 PIL 取，不经过 BGR 转换"""
+    if img.mode in ('RGBA', 'LA', 'PA'): return np.asarray(img.getchannel('A')), True
+    if img.mode == 'P' and 'transparency' in img.info: return np.asarray(img.convert('RGBA').getchannel('A')), True
+    return np.asarray(img if img.mode == 'L' else img.convert('L')), False
+
+def _read_int(path):
+    try:
+        with open(path) as f: return int(f.read().strip())
+    except (OSError, ValueError):
+        return None  # 文件不存在，或 cgroup v2 的 "max" (不限制)
+
+def cgroup_available():
+    """容器的内存上限减去已用量 (cgroup v2 / v1)；没有限制时返回 None"""
+    for limit_path, usage_path in (('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+                                   ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                                    '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        limit = _read_int(limit_path)
+        # v1 不限制时是一个接近 2^63 的数
+        if limit is None or limit >= 1 << 60: continue
+        return max(0, limit - (_read_int(usage_path) or 0))
+    return None
+
+def available_memory():
+    """宿主机 MemAvailable 与容器 cgroup 剩余额度取小：容器里 /proc/meminfo 显示的是宿主机的内存"""
+    host = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    host = int(line.split()[1]) * 1024
+                    break
+    except OSError: pass
+    limits = [v for v in (host, cgroup_available()) if v is not None]
+    return min(limits) if limits else None
+
+def matting_batch_size():
+    if MATTING_BATCH_SIZE > 0: return MATTING_BATCH_SIZE
+    avail = available_memory()
+    if avail is None: return 1
+    # 只用可用内存的四分之一做批量推理，给解码/后处理留余量
+    return max(1, min(MATTING_BATCH_MAX, int(avail * 0.25 // (MATTING_IMAGE_MB * 1024 * 1024))))
+
+def model_input_size(inner, size, speed):
+    """fast 档在模型接受可变输入尺寸时缩小到 FAST_INPUT_EDGE，输入尺寸固定的模型仍用原尺寸"""
+    if speed != 'fast': return size
+    dims = inner.get_inputs()[0].shape[2:]
+    if all(isinstance(d, int) for d in dims): return size
+    return (min(size[0], FAST_INPUT_EDGE), min(size[1], FAST_INPUT_EDGE))
+
+def guided_upsample(pred, img, edge=GUIDED_EDGE, radius=GUIDED_RADIUS, eps=GUIDED_EPS, rows=256):
+    """快速导向滤波上采样：在最长边 edge 的中间尺寸上以灰度原图为引导求局部线性系数 q = a*I + b，
+    再按条带把系数双线性放大、与该条带的灰度图相乘得到原图尺寸的蒙版，边缘贴合原图；整图只分配输出蒙版本身"""
+    import cv2
+    w, h = img.size
+    scale = min(1.0, edge / max(w, h))
+    lw, lh = max(1, round(w * scale)), max(1, round(h * scale))
+    guide = np.asarray(img.resize((lw, lh), Image.BILINEAR, reducing_gap=2.0).convert('L'), dtype=np.float32) / 255
+    p = cv2.resize(pred.astype(np.float32), (lw, lh), interpolation=cv2.INTER_LINEAR)
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    mean_i, mean_p = cv2.boxFilter(guide, -1, ksize), cv2.boxFilter(p, -1, ksize)
+    var_i = cv2.boxFilter(guide * guide, -1, ksize) - mean_i * mean_i
+    a = (cv2.boxFilter(guide * p, -1, ksize) - mean_i * mean_p) / (var_i + eps)
+    b = mean_p - a * mean_i
+    a, b = cv2.boxFilter(a, -1, ksize), cv2.boxFilter(b, -1, ksize)
+    out = np.empty((h, w), np.uint8)
+    for y0 in range(0, h, rows):
+        y1 = min(h, y0 + rows)
+        # 纵向先在中间尺寸上插值出这一条的系数行，横向交给 cv2.resize (高度不变时只做水平插值)
+        sy = np.clip((np.arange(y0, y1) + 0.5) * lh / h - 0.5, 0, lh - 1)
+        i0 = sy.astype(np.int32)
+        i1 = np.minimum(i0 + 1, lh - 1)
+        f = (sy - i0).astype(np.float32)[:, None]
+        strip_a = cv2.resize(a[i0] + (a[i1] - a[i0]) * f, (w, y1 - y0), interpolation=cv2.INTER_LINEAR)
+        strip_b = cv2.resize(b[i0] + (b[i1] - b[i0]) * f, (w, y1 - y0), interpolation=cv2.INTER_LINEAR)
+        strip_a *= np.asarray(img.crop((0, y0, w, y1)).convert('L'))
+        strip_a += strip_b * 255
+        np.clip(strip_a + 0.5, 0, 255, out=strip_a)
+        out[y0:y1] = strip_a
+    return Image.fromarray(out, mode="L")
+
+def model_input(img, size, mean, std, speed='normal'):
+    """与 rembg 相同的预处理：缩放到模型输入尺寸、按最大值归一化再标准化，返回 CHW float32。
+    fast 档用双线性 (先整数倍缩小) 代替 Lanczos"""
+    rgb = img if img.mode == "RGB" else img.convert("RGB")
+    if speed == 'fast': rgb = rgb.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    else: rgb = rgb.resize(size, Image.LANCZOS)
+    arr = np.asarray(rgb, dtype=np.float32)
+    arr /= max(float(arr.max()), 1e-6)
+    arr -= mean
+    arr /= std
+    return arr.transpose(2, 0, 1)
+
+def predict_masks(images, model=MATTING_MODEL, speed=MATTING_SPEED):
+    """批量推理：多张图缩放到模型输入尺寸后拼成一个 NCHW tensor 一次送入 session，再把蒙版缩放回各自原尺寸。
+    fast 档缩小输入，蒙版用导向滤波放大"""
+    session = model_registry.get(model)
+    if base_model(model) not in MODEL_INPUTS:
+        from rembg import remove
+        return [remove(img, session=session, only_mask=True) for img in images]
+    size, mean, std = MODEL_INPUTS[base_model(model)]
+    inner = session.inner_session
+    size = model_input_size(inner, size, speed)
+    batch = np.empty((len(images), 3, size[1], size[0]), dtype=np.float32)
+    for i, img in enumerate(images): batch[i] = model_input(img, size, mean, std, speed)
+    input_name = inner.get_inputs()[0].name
+    try:
+        pred = inner.run(None, {input_name: batch})[0][:, 0]
+    except Exception:
+        # 导出时 batch 维固定为 1 的模型只能逐张跑
+        pred = np.concatenate([inner.run(None, {input_name: batch[i:i + 1]})[0][:, 0] for i in range(len(images))])
+    masks = []
+    for img, p in zip(images, pred):
+        mi, ma = float(p.min()), float(p.max())
+        p = (p - mi) / (ma - mi) if ma > mi else np.zeros_like(p)
+        if speed == 'fast':
+            masks.append(guided_upsample(p, img))
+            continue
+        mask = Image.fromarray((p * 255).astype(np.uint8), mode="L")
+        masks.append(mask.resize(img.size, Image.LANCZOS))
+    return masks
+
+def get_alpha_masks(images, content_keys, model=MATTING_MODEL, batch_size=None, speed=MATTING_SPEED):
+    masks = [mask_cache.get((key, model, speed)) for key in content_keys]
+    todo = [i for i, m in enumerate(masks) if m is None]
+    size = batch_size or matting_batch_size()
+    for start in range(0, len(todo), size):
+        chunk = todo[start:start + size]
+        with stage('inference'): predicted = predict_masks([images[i] for i in chunk], model, speed)
+        for i, mask in zip(chunk, predicted):
+            masks[i] = mask
+            mask_cache.put((content_keys[i], model, speed), mask, mask.width * mask.height)
+    return masks
+
+def get_alpha_mask(img, content_key, model=MATTING_MODEL, speed=MATTING_SPEED):
+    return get_alpha_masks([img], [content_key], model, speed=speed)[0]
+
+# SVG 内缩的曲线采样容差 (px)：设置后按曲率自适应取点，不设置则每条路径固定 1000 个点
+SVG_SAMPLE_TOLERANCE = float(os.environ.get('SVG_SAMPLE_TOLERANCE', 0)) or None
+# 路径数达到该值时把 buffer 拆块并行计算
+SVG_PARALLEL_MIN_PATHS = int(os.environ.get('SVG_PARALLEL_MIN_PATHS', 256))
+SVG_WORKERS = int(os.environ.get('SVG_WORKERS', os.cpu_count() or 1))
 
 BLACK_COLORS = {'#000', '#000000', 'black', 'rgb(0,0,0)', 'rgba(0,0,0,1)'}
 
@@ -16,135 +459,440 @@ def is_black_path(attr):
     stroke = attr.get('stroke', 'none').strip().lower()
     return fill in BLACK_COLORS or stroke in BLACK_COLORS
 
-def path_to_polygon(path, num_samples=500):
-    points = []
-    for i in range(num_samples):
-        t = i / num_samples
-        point = path.point(t)
-        points.append((point.real, point.imag))
-    if points[0] != points[-1]: points.append(points[0])
-    return Polygon(points)
+def fill_rule(attr):
+    """路径的 fill-rule (属性或 style 里的)，默认 nonzero"""
+    rule = attr.get('fill-rule')
+    for item in attr.get('style', '').split(';'):
+        name, _, value = item.partition(':')
+        if name.strip() == 'fill-rule': rule = value
+    return 'evenodd' if (rule or '').strip().lower() == 'evenodd' else 'nonzero'
+
+def _cubic_controls(path):
+    """把路径的直线/二次/三次段统一升阶为三次贝塞尔控制点 (n, 4) 复数数组；圆弧段单独返回"""
+    controls = np.empty((len(path), 4), dtype=complex)
+    arcs = {}
+    for i, seg in enumerate(path):
+        bp = seg.bpoints() if hasattr(seg, 'bpoints') and not hasattr(seg, 'radius') else None
+        if bp is None:
+            arcs[i] = seg
+            controls[i] = seg.start, seg.start, seg.end, seg.end
+        elif len(bp) == 2:
+            controls[i] = bp[0], bp[0] + (bp[1] - bp[0]) / 3, bp[1] + (bp[0] - bp[1]) / 3, bp[1]
+        elif len(bp) == 3:
+            controls[i] = bp[0], bp[0] + 2 * (bp[1] - bp[0]) / 3, bp[2] + 2 * (bp[1] - bp[2]) / 3, bp[2]
+        else:
+            controls[i] = bp
+    return controls, arcs
+
+def _eval_cubic(controls, seg_idx, t):
+    p0, p1, p2, p3 = (controls[seg_idx, k] for k in range(4))
+    mt = 1 - t
+    return mt * mt * mt * p0 + 3 * mt * mt * t * p1 + 3 * mt * t * t * p2 + t * t * t * p3
+
+def sample_path(path, num_samples=1000, tolerance=None):
+    """用 NumPy 一次算出整条路径的采样点 (复数数组，不含重复的终点)。
+    默认与 path.point(i/num_samples) 一样按段长分配点数、段内 t 均匀；给定 tolerance(px) 时按曲率自适应取点"""
+    return _sample(path, num_samples, tolerance)[0]
+
+def _sample(path, num_samples, tolerance):
+    controls, arcs = _cubic_controls(path)
+    if tolerance:
+        # 三次贝塞尔二阶导上界 6*max|P[i+2]-2P[i+1]+P[i]|，分 n 段的弦高误差 <= M/(8n^2)
+        dd = np.maximum(np.abs(controls[:, 2] - 2 * controls[:, 1] + controls[:, 0]),
+                        np.abs(controls[:, 3] - 2 * controls[:, 2] + controls[:, 1]))
+        counts = np.ceil(np.sqrt(6 * dd / (8 * tolerance))).astype(int)
+        # 圆弧的控制点只是两端点 (弦)：按扫过的角度和半径取点，半径 r 的圆弧每段弦高 r(1-cos(θ/2)) <= tolerance
+        for i, seg in arcs.items():
+            r = max(abs(seg.radius.real), abs(seg.radius.imag))
+            step = 2 * np.arccos(np.clip(1 - tolerance / r, -1, 1)) if r > 0 else np.pi
+            counts[i] = int(np.ceil(abs(np.radians(seg.delta)) / max(step, 1e-6)))
+    else:
+        # 用每段 16 个点的折线长度近似段长
+        probe = np.linspace(0, 1, 17)
+        pts = _eval_cubic(controls, np.arange(len(controls))[:, None], probe[None, :])
+        lengths = np.abs(np.diff(pts, axis=1)).sum(axis=1)
+        for i, seg in arcs.items(): lengths[i] = seg.length()
+        total = lengths.sum()
+        counts = np.round(lengths / total * num_samples).astype(int) if total > 0 else np.zeros(len(path), int)
+    counts = np.clip(counts, 1, 4096)
+    seg_idx = np.repeat(np.arange(len(path)), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - starts[seg_idx]) / counts[seg_idx]
+    points = _eval_cubic(controls, seg_idx, t)
+    for i, seg in arcs.items():
+        sel = seg_idx == i
+        points[sel] = [seg.point(x) for x in t[sel]]
+    return points, seg_idx, controls
+
+def path_rings(path, num_samples=1000, tolerance=None):
+    """按子路径 (M 开始的每一段) 拆成若干闭合环，返回 [(k, 2) 坐标数组]"""
+    if not len(path): return []
+    points, seg_idx, controls = _sample(path, num_samples, tolerance)
+    # 某段起点不等于上一段终点 => 新的子路径
+    breaks = np.flatnonzero(np.abs(controls[1:, 0] - controls[:-1, 3]) > 1e-9) + 1
+    rings = []
+    for ring in np.split(points, np.searchsorted(seg_idx, breaks)):
+        if len(ring) >= 3: rings.append(np.column_stack((ring.real, ring.imag)))
+    return rings
+
+def path_to_polygon(path, num_samples=500, tolerance=None, rule='nonzero'):
+    return paths_to_geometries([path], num_samples, tolerance, [rule])[0]
+
+def paths_to_geometries(paths, num_samples=1000, tolerance=None, rules=None):
+    """整篇文档的路径一次性转成 shapely 几何数组；同一路径的多个子路径按各自的 fill-rule 组合，孔洞得以保留。
+    evenodd 取对称差；nonzero (默认) 按环绕数保留面"""
+    import shapely
+    geoms = np.full(len(paths), None, dtype=object)
+    rings, owners = [], []
+    for i, path in enumerate(paths):
+        for ring in path_rings(path, num_samples, tolerance):
+            rings.append(ring)
+            owners.append(i)
+    if not rings: return geoms
+    ring_idx = np.repeat(np.arange(len(rings)), [len(r) for r in rings])
+    lines = shapely.linearrings(np.concatenate(rings), indices=ring_idx)
+    polys = shapely.polygons(lines)
+    invalid = ~shapely.is_valid(polys)
+    if invalid.any(): polys[invalid] = shapely.buffer(polys[invalid], 0)
+    owners = np.asarray(owners)
+    for i in np.unique(owners):
+        sel = np.flatnonzero(owners == i)
+        parts = polys[sel]
+        if len(parts) == 1 and not invalid[sel[0]]: geoms[i] = parts[0]
+        elif rules is not None and rules[i] == 'evenodd':
+            geoms[i] = parts[0] if len(parts) == 1 else shapely.symmetric_difference_all(parts)
+        else: geoms[i] = nonzero_fill([rings[j] for j in sel], lines[sel])
+    return geoms
+
+def winding_numbers(ring, x, y):
+    """闭合折线 ring (k, 2) 绕各点 (x, y) 的圈数，向量化的交叉计数"""
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    px, py = x[:, None], y[:, None]
+    cross = (x1 - x0) * (py - y0) - (px - x0) * (y1 - y0)
+    up = (y0 <= py) & (y1 > py) & (cross > 0)
+    down = (y0 > py) & (y1 <= py) & (cross < 0)
+    return up.sum(axis=1) - down.sum(axis=1)
+
+def nonzero_fill(rings, lines):
+    """nonzero 填充：所有环的边界打断后拆成面，每个面取一个内点累加各环的环绕数，不为 0 的面合并"""
+    import shapely
+    faces = shapely.get_parts(shapely.polygonize([shapely.union_all(lines)]))
+    if not len(faces): return shapely.Polygon()
+    points = shapely.get_coordinates(shapely.point_on_surface(faces))
+    winding = sum(winding_numbers(ring, points[:, 0], points[:, 1]) for ring in rings)
+    return shapely.union_all(faces[winding != 0])
+
+def buffer_geometries(geoms, distance):
+    """向量化 buffer；路径数很多时拆块交给线程池 (shapely 2 的向量化运算会释放 GIL)"""
+    import shapely
+    kwargs = dict(quad_segs=16, join_style='mitre', mitre_limit=2.0)
+    if len(geoms) < SVG_PARALLEL_MIN_PATHS or SVG_WORKERS <= 1:
+        return shapely.buffer(geoms, distance, **kwargs)
+    from concurrent.futures import ThreadPoolExecutor
+    chunks = np.array_split(geoms, SVG_WORKERS)
+    with ThreadPoolExecutor(SVG_WORKERS) as pool:
+        return np.concatenate(list(pool.map(lambda c: shapely.buffer(c, distance, **kwargs), chunks)))
+
+def geometry_rings(geoms):
+    """几何数组 -> 每个几何的环列表 (外环/内环方向统一，合并后用 nonzero 填充仍能正确镂空)，全程向量化"""
+    import shapely
+    result = [[] for _ in range(len(geoms))]
+    parts, part_owner = shapely.get_parts(geoms, return_index=True)
+    if not len(parts): return result
+    if hasattr(shapely, 'orient_polygons'): parts = shapely.orient_polygons(parts)
+    else:
+        from shapely.geometry.polygon import orient
+        parts = np.array([orient(p) for p in parts], dtype=object)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    splits = np.flatnonzero(np.diff(coord_ring)) + 1
+    for ring_index, ring_coords in zip(coord_ring[np.r_[0, splits]], np.split(coords, splits)):
+        result[part_owner[ring_part[ring_index]]].append(ring_coords)
+    return result
 
 def polygon_to_svg_path(polygon):
-    if polygon.is_empty: return ""
-    coords = list(polygon.exterior.coords)
-    path_data = f"M {coords[0][0]:.2f},{coords[0][1]:.2f}"
-    for x, y in coords[1:]: path_data += f" L {x:.2f},{y:.2f}"
-    path_data += " Z"
-    return path_data
-
-def shrink_path_precisely(path, shrink_px=8):
+    """多边形 (含 MultiPolygon) 的外环和内环都输出为子路径，组成复合路径"""
+    if polygon is None or polygon.is_empty: return ""
+    return rings_d(geometry_rings(np.array([polygon], dtype=object))[0])
+
+def shrink_paths(paths, shrink_px=8, tolerance=SVG_SAMPLE_TOLERANCE, rules=None):
+    """整篇文档一起内缩，返回每条路径的环列表；内缩后为空或出错的路径返回原 path data 字符串"""
     try:
-        polygon = path_to_polygon(path, num_samples=1000)
-        if not polygon.is_valid: polygon = polygon.buffer(0)
-        shrunk_polygon = polygon.buffer(-shrink_px, resolution=16, join_style=2, mitre_limit=2.0)
-        if shrunk_polygon.is_empty: return path
-        if isinstance(shrunk_polygon, MultiPolygon):
-            shrunk_polygon = max(shrunk_polygon.geoms, key=lambda p: p.area)
-        path_string = polygon_to_svg_path(shrunk_polygon)
-        return parse_path(path_string)
-    except:
-        return path
-
-def process_bottle_svg(input_path, output_path, shrink_px=8):
-    paths, attributes, svg_attrs = svg2paths2(input_path)
-    processed_paths = []
-    processed_attrs = []
-    for path, attr in zip(paths, attributes):
-        if is_black_path(attr):
-            shrunk_path = shrink_path_precisely(path, shrink_px)
-            processed_paths.append(shrunk_path)
-            processed_attrs.append({'fill': 'black', 'stroke': 'none', 'fill-opacity': '1'})
-    wsvg(processed_paths, attributes=processed_attrs, filename=output_path, svg_attributes=svg_attrs)
-
-def process_raster_image(input_path, output_path, shrink_px=8):
+        geoms = paths_to_geometries(paths, num_samples=1000, tolerance=tolerance, rules=rules)
+        valid = np.array([g is not None for g in geoms], dtype=bool)
+        shrunk = np.full(len(paths), None, dtype=object)
+        if valid.any(): shrunk[valid] = buffer_geometries(geoms[valid], -shrink_px)
+        rings = geometry_rings(shrunk)
+    except Exception:
+        return [path.d() for path in paths]
+    return [r if r else path.d() for path, r in zip(paths, rings)]
+
+def shrink_path_precisely(path, shrink_px=8, tolerance=SVG_SAMPLE_TOLERANCE, rule='nonzero'):
+    from svgpathtools import parse_path
     try:
-        img = Image.open(input_path).convert("RGBA")
-        filter_size = (shrink_px * 2) + 1
-        r, g, b, a = img.split()
-        shrunk_a = a.filter(ImageFilter.MinFilter(filter_size))
-        img = Image.merge("RGBA", (r, g, b, shrunk_a))
-        final_output = output_path
-        if not final_output.lower().endswith('.png'):
-             final_output = os.path.splitext(output_path)[0] + '.png'
-        img.save(final_output, format="PNG")
-        return final_output
+        result = shrink_paths([path], shrink_px, tolerance, [rule])[0]
+        return parse_path(result if isinstance(result, str) else rings_d(result))
+    except: return path
+
+def process_bottle_svg(input_path, output_path, shrink_px=8, tolerance=SVG_SAMPLE_TOLERANCE):
+    from svgpathtools import svg2paths2
+    if isinstance(input_path, (bytes, bytearray, memoryview)): input_path = io.BytesIO(input_path)
+    output_path = output_target(output_path, '.svg')
+    with stage('svg_parse'): paths, attributes, svg_attrs = svg2paths2(input_path)
+    black = [(path, fill_rule(attr)) for path, attr in zip(paths, attributes) if is_black_path(attr)]
+    black_paths, rules = [p for p, _ in black], [r for _, r in black]
+    attrs = {'fill': 'black', 'stroke': 'none', 'fill-opacity': '1'}
+    with stage('geometry'): results = shrink_paths(black_paths, shrink_px, tolerance, rules)
+    # 直接把坐标数组写成紧凑的 path data；内缩结果方向统一，可以合并成一个 <path>
+    with stage('svg_write'), open_svg(output_path, svg_attrs) as svg:
+        for result in results:
+            if isinstance(result, str): svg.add_path(result, attrs, merge=False)
+            else: svg.add_path(rings_d(result), attrs)
+    add_bytes('svg_write', output_size(output_path))
+    return output_path
+
+# 距离场缓存：内缩/外扩/描边都是对同一个有符号距离场取阈值 (默认 32MB，可用 MORPH_CACHE_MB 调整)
+field_cache = LRUCache(int(os.environ.get('MORPH_CACHE_MB', 32)) * 1024 * 1024)
+FIELD_PAD_STEP = 32
+
+class DistanceField:
+    """alpha 蒙版的有符号欧氏距离场 (alpha > level 为内部，内部为正，单位 px)"""
+    def __init__(self, alpha, level=127):
+        import cv2
+        t0 = time.perf_counter()
+        inside = (np.asarray(alpha) > level).astype(np.uint8)
+        d_in = cv2.distanceTransform(inside, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        d_out = cv2.distanceTransform(1 - inside, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        # 像素中心到边界的距离：边界落在内外两个像素中间
+        self.sd = np.where(inside > 0, d_in - 0.5, 0.5 - d_out).astype(np.float32)
+        self.nbytes = self.sd.nbytes
+        add_stage('distance_field', time.perf_counter() - t0)
+
+    def coverage(self, offset, out=None):
+        """距离 > offset 的区域 (offset>0 为内缩，<0 为外扩)，边缘 1px 抗锯齿，返回 0~1 的 float32。
+        传入 out 时结果写进 out，不另分配"""
+        out = np.subtract(self.sd, offset - 0.5, out=out)
+        return np.clip(out, 0, 1, out=out)
+
+    def band(self, lo, hi, out=None):
+        out = self.coverage(lo, out)
+        return np.subtract(out, self.coverage(hi), out=out)
+
+def get_distance_field(alpha, key=None, level=127):
+    """计算量与半径无关；同一张图调滑块时复用缓存的距离场。key 需要区分 level"""
+    field = field_cache.get(key) if key else None
+    if field is not None: return field
+    field = DistanceField(alpha, level)
+    if key: field_cache.put(key, field, field.nbytes)
+    return field
+
+# 位图输出编码：导出默认 PNG (压缩级别 6)，预览默认快速 PNG；无损 WebP 编码更快、体积更小
+RASTER_ENCODINGS = {
+    'png': ('.png', {'format': 'PNG', 'compress_level': int(os.environ.get('PNG_COMPRESS_LEVEL', 6))}),
+    'png-fast': ('.png', {'format': 'PNG', 'compress_level': 1}),
+    'webp': ('.webp', {'format': 'WEBP', 'lossless': True, 'quality': 25, 'method': 1}),
+}
+EXPORT_ENCODING = os.environ.get('EXPORT_ENCODING', 'png')
+PREVIEW_ENCODING = os.environ.get('PREVIEW_ENCODING', 'png-fast')
+RASTER_MIMETYPES = {'.png': 'image/png', '.webp': 'image/webp', '.svg': 'image/svg+xml'}
+
+class MemoryOutput(io.BytesIO):
+    """代替输出路径传给各处理函数，结果写在内存里；ext 为实际输出格式的扩展名"""
+    ext = None
+
+def output_target(output, ext):
+    """输出路径换成实际格式的扩展名；内存输出只记下扩展名"""
+    if isinstance(output, MemoryOutput):
+        output.ext = ext
+        return output
+    return os.path.splitext(output)[0] + ext
+
+def output_size(output):
+    return output.tell() if isinstance(output, MemoryOutput) else os.path.getsize(output)
+
+def raster_target(output_path, encoding=None, tiled=False):
+    """返回 (实际输出路径, PIL save 参数)；未知编码按导出编码处理，分条写出只支持 PNG，没有 WebP 支持时退回快速 PNG"""
+    from PIL import features
+    if encoding not in RASTER_ENCODINGS: encoding = EXPORT_ENCODING
+    if encoding == 'webp' and (tiled or not features.check('webp')): encoding = 'png-fast'
+    ext, options = RASTER_ENCODINGS[encoding]
+    return output_target(output_path, ext), options
+
+def save_image(img, output_path, **options):
+    with stage('encode'): img.save(output_path, **options)
+    add_bytes('encode', output_size(output_path))
+    return output_path
+
+# 超大图分条处理：像素数超过 TILE_MIN_MP (百万) 时按 TILE_ROWS 行一条，条带上下带 halo，PNG 流式写出
+TILE_MIN_PIXELS = int(float(os.environ.get('TILE_MIN_MP', 16)) * 1000000)
+TILE_ROWS = int(os.environ.get('TILE_ROWS', 512))
+
+def use_tiles(img):
+    return img.width * img.height > TILE_MIN_PIXELS
+
+def canvas_reader(read_rows, width, height, pad=0):
+    """把按原图行号读取的 read_rows(y0, y1) 包装成四周扩出 pad 像素透明边的画布读取函数"""
+    def read(y0, y1):
+        out = np.zeros((y1 - y0, width + 2 * pad, 4), dtype=np.uint8)
+        s0, s1 = max(0, y0 - pad), min(height, y1 - pad)
+        if s1 > s0: out[s0 - (y0 - pad):s1 - (y0 - pad), pad:pad + width] = read_rows(s0, s1)
+        return out
+    return read
+
+def process_tiled(read_rows, width, height, halo, transform, output_path, compress_level=None):
+    """read_rows(y0, y1) 返回画布 [y0, y1) 行的 RGBA；transform 处理上下各带 halo 行的条带。
+    距离场只需要看到 halo 以内的边界，所以逐条计算和整图计算结果一致"""
+    from png_writer import PngStreamWriter
+    with stage('tiled'), PngStreamWriter(output_path, width, height, compress_level=compress_level or 6) as png:
+        for y0 in range(0, height, TILE_ROWS):
+            y1 = min(height, y0 + TILE_ROWS)
+            h0, h1 = max(0, y0 - halo), min(height, y1 + halo)
+            png.write(transform(read_rows(h0, h1))[y0 - h0:y1 - h0])
+    add_bytes('tiled', output_size(output_path))
+    return output_path
+
+def image_rows(img):
+    return lambda y0, y1: np.array(img.crop((0, y0, img.width, y1)).convert("RGBA"))
+
+def content_box(alpha, margin=0, level=0):
+    """alpha > level 的外接矩形四周扩 margin 像素，可以超出图像 (PIL crop 超出部分补透明)；全透明返回 None。
+    alpha 为 L 模式图像或 uint8 数组"""
+    if isinstance(alpha, np.ndarray): alpha = Image.fromarray(alpha)
+    if level > 0: alpha = alpha.point(lambda v: 255 if v > level else 0)
+    box = alpha.getbbox()
+    return box and (box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin)
+
+def clip_box(box, width, height):
+    return max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height)
+
+def erode_alpha(alpha, field, shrink_px):
+    """按距离场内缩 alpha (原地)：覆盖率换成 0~255 后与原 alpha 取小，半透明内容保留原来的透明度只削掉边缘。
+    field 应以 alpha > 0 (内容范围) 为内部，与 MinFilter 的结果一致"""
+    cover = field.coverage(shrink_px)
+    cover *= 255
+    cover += 0.5
+    np.minimum(cover, alpha, out=cover)
+    np.copyto(alpha, cover, casting='unsafe')
+    return alpha
+
+def shrink_alpha(rgba, shrink_px):
+    """内缩只影响有内容的区域：距离场只在 alpha 外接矩形 (+1px 透明边) 内计算，矩形外的像素不变"""
+    alpha = rgba[:, :, 3]
+    box = content_box(alpha, 1)
+    if box is None: return rgba
+    x0, y0, x1, y1 = clip_box(box, alpha.shape[1], alpha.shape[0])
+    crop = alpha[y0:y1, x0:x1]
+    erode_alpha(crop, DistanceField(crop, level=0), shrink_px)
+    return rgba
+
+def process_raster_image(input_path, output_path, shrink_px=8, content_key=None, encoding=None):
+    try:
+        img = open_image(input_path)
+        final_output, save_options = raster_target(output_path, encoding, use_tiles(img))
+        if use_tiles(img):
+            # 不再整图 convert/split/merge，每条单独转 RGBA 并内缩
+            transform = (lambda rgba: shrink_alpha(rgba, shrink_px)) if shrink_px > 0 else (lambda rgba: rgba)
+            return process_tiled(image_rows(img), img.width, img.height, max(shrink_px, 0) + 2, transform, final_output,
+                                 save_options['compress_level'])
+        return save_image(shrink_image(img, shrink_px, content_key), final_output, **save_options)
     except Exception as e:
         return output_path
 
+def shrink_image(img, shrink_px=8, content_key=None):
+    """内存版内缩：PIL 图像进，RGBA 图像出"""
+    with stage('decode'): img = img.convert("RGBA")
+    if shrink_px <= 0: return img
+    a = img.getchannel('A')
+    box = content_box(a, 1)
+    if box is None: return img
+    # 只在内容外接矩形 (+1px 透明边) 内算距离场：矩形边上全是透明像素，距离和整图计算完全一致
+    box = clip_box(box, img.width, img.height)
+    alpha = np.array(a)
+    crop = alpha[box[1]:box[3], box[0]:box[2]]
+    field = get_distance_field(crop, content_key and ('shrink', content_key), level=0)
+    with stage('morphology'): erode_alpha(crop, field, shrink_px)
+    img.putalpha(Image.fromarray(alpha))
+    return img
+
+def rounded_corners(rings, radius):
+    """所有轮廓的所有顶点一次性计算圆角：返回每个轮廓的 (起点, 直线终点, 控制点, 曲线终点)"""
+    lengths = np.array([len(r) for r in rings])
+    pts = np.concatenate(rings).astype(float)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    local = np.arange(len(pts)) - starts
+    size = np.repeat(lengths, lengths)
+    nxt = starts + (local + 1) % size
+    prv = starts + (local - 1) % size
+    to_next = pts[nxt] - pts
+    dist_next = np.hypot(to_next[:, 0], to_next[:, 1])
+    dist_prev = dist_next[prv]
+    # 圆角半径不超过相邻两条边较短者的一半
+    r = np.minimum(radius, np.minimum(dist_prev, dist_next) / 2.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out_pt = pts + np.where((dist_next > 0)[:, None], to_next / dist_next[:, None], 0) * r[:, None]
+        in_pt = pts + np.where((dist_prev > 0)[:, None], -to_next[prv] / dist_prev[:, None], 0) * r[:, None]
+    result = []
+    for s0, n in zip(np.cumsum(lengths) - lengths, lengths):
+        order = s0 + (np.arange(1, n + 1) % n)
+        result.append((out_pt[s0], in_pt[order], pts[order], out_pt[order]))
+    return result
+
 def get_rounded_path_d(points, radius):
-    n = len(points)
-    if n < 3: return ""
-    dists = []
-    for i in range(n):
-        p1 = points[i]
-        p2 = points[(i+1)%n]
-        d = np.linalg.norm(p1 - p2)
-        dists.append(d)
-    radii = []
-    for i in range(n):
-        prev_dist = dists[i-1]
-        next_dist = dists[i]
-        max_r = min(prev_dist, next_dist) / 2.0
-        radii.append(min(radius, max_r))
-    path_cmds = []
-    def get_pt(idx, direction, r):
-        p_center = points[idx]
-        target_idx = (idx + direction) % n
-        p_target = points[target_idx]
-        vec = p_target - p_center
-        length = np.linalg.norm(vec)
-        if length == 0: return p_center
-        return p_center + (vec / length) * r
-    start_pt = get_pt(0, 1, radii[0])
-    path_cmds.append(f"M {start_pt[0]:.2f},{start_pt[1]:.2f}")
-    for i in range(n):
-        next_i = (i + 1) % n
-        line_target = get_pt(next_i, -1, radii[next_i])
-        path_cmds.append(f"L {line_target[0]:.2f},{line_target[1]:.2f}")
-        ctrl_pt = points[next_i]
-        curve_end = get_pt(next_i, 1, radii[next_i])
-        path_cmds.append(f"Q {ctrl_pt[0]:.2f},{ctrl_pt[1]:.2f} {curve_end[0]:.2f},{curve_end[1]:.2f}")
-    path_cmds.append("Z")
-    return " ".join(path_cmds)
-
-def convert_bitmap_to_svg(input_path, output_path, fill_color='black', smoothness=4, corner_radius=0):
+    if len(points) < 3: return ""
+    return rounded_ring_d(*rounded_corners([np.asarray(points)], radius)[0])
+
+# 矢量化轮廓缓存：调平滑度/圆角时跳过读图、二值化和 findContours (默认 16MB，可用 CONTOUR_CACHE_MB 调整)
+contour_cache = LRUCache(int(os.environ.get('CONTOUR_CACHE_MB', 16)) * 1024 * 1024)
+
+def bitmap_contours(channel, is_alpha):
+    """二值化并提取外轮廓，返回 (宽, 高, 轮廓列表, 面积数组, 周长数组)"""
+    import cv2
+    if is_alpha:
+        _, binary = cv2.threshold(channel, 10, 255, cv2.THRESH_BINARY)
+    else:
+        _, binary = cv2.threshold(channel, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    height, width = binary.shape
+    areas = np.array([cv2.contourArea(c) for c in contours])
+    perimeters = np.array([cv2.arcLength(c, True) for c in contours])
+    return width, height, contours, areas, perimeters
+
+def get_bitmap_contours(input_path, content_key=None):
+    if content_key is None: content_key = content_digest(input_path)
+    cached = contour_cache.get(content_key) if content_key else None
+    if cached is not None: return cached
     try:
-        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-        if img is None: return False
-        binary = None
-        if len(img.shape) == 3 and img.shape[2] == 4:
-            alpha_channel = img[:, :, 3]
-            _, binary = cv2.threshold(alpha_channel, 10, 255, cv2.THRESH_BINARY)
-        else:
-            if len(img.shape) == 3:
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = img
-            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        svg_paths = []
-        svg_attrs = []
-        height, width = binary.shape
+        with stage('decode'): channel, is_alpha = threshold_channel(open_image(input_path))
+    except (OSError, ValueError):
+        return None
+    result = bitmap_contours(channel, is_alpha)
+    if content_key: contour_cache.put(content_key, result, sum(c.nbytes for c in result[2]) + 16 * len(result[2]) + 64)
+    return result
+
+def convert_bitmap_to_svg(input_path, output_path, fill_color='black', smoothness=4, corner_radius=0, min_area=50,
+                          content_key=None):
+    import cv2
+    try:
+        with stage('contours'): found = get_bitmap_contours(input_path, content_key)
+        if found is None: return False
+        width, height, contours, areas, perimeters = found
         epsilon_factor = float(smoothness) * 0.0005
-        for cnt in contours:
-            if cv2.contourArea(cnt) < 50: continue 
-            epsilon = epsilon_factor * cv2.arcLength(cnt, True)
-            approx = cv2.approxPolyDP(cnt, epsilon, True)
-            points = approx.reshape(-1, 2).astype(float)
-            if len(points) < 3: continue
-            if corner_radius > 0:
-                path_d = get_rounded_path_d(points, float(corner_radius))
+        rings = []
+        with stage('simplify'):
+            for cnt, area, perimeter in zip(contours, areas, perimeters):
+                if area < min_area: continue
+                approx = cv2.approxPolyDP(cnt, epsilon_factor * perimeter, True)
+                if len(approx) >= 3: rings.append(approx.reshape(-1, 2))
+        final_output = output_target(output_path, '.svg')
+        # 外轮廓互不重叠，同色路径合并成一个 <path> 输出
+        with stage('svg_write'), open_svg(final_output, {'width': str(width), 'height': str(height), 'viewBox': f'0 0 {width} {height}'}) as svg:
+            if rings and corner_radius > 0:
+                for corners in rounded_corners(rings, float(corner_radius)):
+                    svg.add_path(rounded_ring_d(*corners), {'fill': fill_color, 'stroke': 'none'})
             else:
-                path_d = f"M {points[0][0]},{points[0][1]}"
-                for p in points[1:]: path_d += f" L {p[0]},{p[1]}"
-                path_d += " Z"
-            if path_d:
-                svg_paths.append(parse_path(path_d))
-                svg_attrs.append({'fill': fill_color, 'stroke': 'none'})
-        final_output = os.path.splitext(output_path)[0] + '.svg'
-        wsvg(svg_paths, attributes=svg_attrs, filename=final_output, 
-             svg_attributes={'width': str(width), 'height': str(height), 'viewBox': f'0 0 {width} {height}'})
+                for points in rings: svg.add_path(ring_d(points), {'fill': fill_color, 'stroke': 'none'})
+        add_bytes('svg_write', output_size(final_output))
         return final_output
     except Exception as e:
         return None
@@ -153,65 +901,267 @@ def hex_to_rgb(hex_color):
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
+def stroke_coverage(field, width, position='outer', offset=0, out=None):
+    """描边区域直接取自距离场，offset 为距离场相对当前边缘的偏移；未知位置返回 None"""
+    if position == 'outer': return field.coverage(offset - width, out)
+    if position == 'inner': return field.band(offset, offset + width, out)
+    if position == 'center': return field.band(offset - width // 2, offset + width // 2, out)
+    return None
+
+def blend_stroke(rgba, cover, color_hex, position='outer'):
+    """纯色描边与 uint8 RGBA 数组原地做 alpha 合成 (outer 描边垫在图像下面，inner/center 盖在上面)，
+    只计算结果会变的像素；描边不透明度先量化到 8 位，与描边图层的结果一致"""
+    sel = cover > 0
+    # 外描边垫在下面，完全不透明的像素不受影响 (外描边的覆盖区包含整个物体内部)
+    if position == 'outer': sel &= rgba[:, :, 3] < 255
+    ys, xs = np.nonzero(sel)
+    if not len(ys): return rgba
+    s = np.round(cover[ys, xs] * 255) / 255
+    px = rgba[ys, xs].astype(np.float32) / 255
+    a = px[:, 3]
+    if position == 'outer': w_img, w_stroke = a, s * (1 - a)
+    else: w_img, w_stroke = a * (1 - s), s
+    out_a = w_img + w_stroke
+    color = np.array(hex_to_rgb(color_hex), np.float32) / 255
+    rgb = (px[:, :3] * w_img[:, None] + color * w_stroke[:, None]) / np.maximum(out_a, 1e-6)[:, None]
+    rgba[ys, xs, :3] = rgb * 255 + 0.5
+    rgba[ys, xs, 3] = out_a * 255 + 0.5
+    return rgba
+
 def apply_stroke(img_pil, width, color_hex, position='outer'):
+    """描边只在 alpha 外接矩形 (+描边宽度) 内计算和合成，再贴回四周扩出 width+5 的画布"""
     if width <= 0: return img_pil
     padding = width + 5
     img = ImageOps.expand(img_pil, border=padding, fill=(0,0,0,0))
-    r, g, b, a = img.split()
-    alpha_np = np.array(a)
-    kernel_size = 2 * width + 1
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
-    stroke_mask = None
-    if position == 'outer':
-        dilated = cv2.dilate(alpha_np, kernel)
-        stroke_mask = Image.fromarray(dilated)
-        base_layer = Image.new("RGBA", img.size, hex_to_rgb(color_hex))
-        base_layer.putalpha(stroke_mask)
-        final = Image.alpha_composite(base_layer, img)
-        return final
-    elif position == 'inner':
-        eroded = cv2.erode(alpha_np, kernel)
-        mask_np = cv2.subtract(alpha_np, eroded) 
-        stroke_layer = Image.new("RGBA", img.size, hex_to_rgb(color_hex))
-        stroke_layer.putalpha(Image.fromarray(mask_np))
-        final = Image.alpha_composite(img, stroke_layer)
-        return final
-    elif position == 'center':
-        w_half = width // 2
-        k_half = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2*w_half+1, 2*w_half+1))
-        dilated = cv2.dilate(alpha_np, k_half)
-        eroded = cv2.erode(alpha_np, k_half)
-        mask_np = cv2.subtract(dilated, eroded)
-        stroke_layer = Image.new("RGBA", img.size, hex_to_rgb(color_hex))
-        stroke_layer.putalpha(Image.fromarray(mask_np))
-        final = Image.alpha_composite(img, stroke_layer)
-        return final
+    box = content_box(img_pil.getchannel('A'), width + 2)
+    if box is None: return img
+    crop = np.array(img_pil.crop(box))
+    cover = stroke_coverage(DistanceField(crop[:, :, 3]), width, position)
+    if cover is None: return img
+    img.paste(Image.fromarray(blend_stroke(crop, cover, color_hex, position)), (box[0] + padding, box[1] + padding))
     return img
 
+def composite_into(dst, img, mask):
+    """Image.composite(img, 全透明, mask) 的数组版本，直接写进 dst (uint8 RGBA，可以是画布上的视图)；
+    cv2 按 round(x * m / 255) 取整，与 PIL 的结果逐像素相同"""
+    import cv2
+    m = np.asarray(mask)
+    cv2.multiply(np.asarray(img), cv2.merge((m, m, m, m)), dst=dst, scale=1 / 255)
+    return dst
+
+def postprocess_alpha(rgba, alpha_threshold=10, edge_shift=0, stroke_width=0, stroke_color='#FFFFFF',
+                      stroke_pos='outer', field_key=None):
+    """抠图后处理：阈值、修边、描边依次原地写回同一块 uint8 RGBA 缓冲，中间不转 PIL 图像；
+    修边和描边共用一个距离场 (按 field_key 缓存) 和一块 float32 暂存"""
+    alpha = rgba[:, :, 3]
+    if alpha_threshold > 0:
+        with stage('morphology'): np.multiply(alpha > alpha_threshold, 255, out=alpha, casting='unsafe')
+    if edge_shift == 0 and stroke_width <= 0: return rgba
+    # 内部取 alpha > 阈值 (与裁剪框一致)：不设阈值时半透明的边缘也算内容，按原透明度内缩而不是整片删掉
+    field = get_distance_field(alpha, field_key, level=max(alpha_threshold, 0))
+    scratch = np.empty(alpha.shape, np.float32)
+    if edge_shift != 0:
+        with stage('morphology'):
+            cover = field.coverage(edge_shift, out=scratch)
+            # 内缩：alpha 与覆盖率取小；外扩：取大
+            cover *= 255
+            cover += 0.5
+            (np.minimum if edge_shift > 0 else np.maximum)(cover, alpha, out=cover)
+            np.copyto(alpha, cover, casting='unsafe')
+    if stroke_width > 0:
+        with stage('stroke'):
+            cover = stroke_coverage(field, stroke_width, stroke_pos, edge_shift, out=scratch)
+            if cover is not None: blend_stroke(rgba, cover, stroke_color, stroke_pos)
+    return rgba
+
+def matting_tiled(img, mask, output_path, alpha_threshold, edge_shift, stroke_width, stroke_color, stroke_pos,
+                  compress_level=None):
+    """超大图抠图：合成、阈值、修边、描边都按条带进行，画布外圈给描边预留"""
+    pad = stroke_width + 5 if stroke_width > 0 else 0
+    def read_rows(y0, y1):
+        box = (0, y0, img.width, y1)
+        return composite_into(np.empty((y1 - y0, img.width, 4), np.uint8), img.crop(box).convert("RGBA"), mask.crop(box))
+    def transform(rgba):
+        # 整条都透明 (常见于商品图的上下留白) 时阈值、修边、描边都不改变任何像素
+        if not rgba[:, :, 3].any(): return rgba
+        return postprocess_alpha(rgba, alpha_threshold, edge_shift, stroke_width, stroke_color, stroke_pos)
+    halo = abs(edge_shift) + max(stroke_width, 0) + 2
+    return process_tiled(canvas_reader(read_rows, img.width, img.height, pad),
+                         img.width + 2 * pad, img.height + 2 * pad, halo, transform, output_path, compress_level)
+
 def remove_background_ai(input_path, output_path, alpha_threshold=10, edge_shift=0, 
-                         stroke_width=0, stroke_color='#FFFFFF', stroke_pos='outer'):
+                         stroke_width=0, stroke_color='#FFFFFF', stroke_pos='outer', content_key=None, mask=None,
+                         encoding=None, model=MATTING_MODEL, speed=MATTING_SPEED):
     try:
-        img = Image.open(input_path).convert("RGBA")
-        result = remove(img, session=rembg_session)
-        if alpha_threshold > 0 or edge_shift != 0:
-            arr = np.array(result)
-            r, g, b, a = arr[:,:,0], arr[:,:,1], arr[:,:,2], arr[:,:,3]
-            if alpha_threshold > 0:
-                a = np.where(a > alpha_threshold, 255, 0).astype(np.uint8)
-            if edge_shift != 0:
-                ks = abs(edge_shift) * 2 + 1
-                k = np.ones((ks, ks), np.uint8)
-                if edge_shift > 0: a = cv2.erode(a, k, iterations=1)
-                else: a = cv2.dilate(a, k, iterations=1)
-            result = Image.fromarray(np.dstack((r, g, b, a)))
-        if stroke_width > 0:
-            result = apply_stroke(result, stroke_width, stroke_color, stroke_pos)
-        final_output = output_path
-        if not final_output.lower().endswith('.png'):
-             final_output = os.path.splitext(output_path)[0] + '.png'
-        result.save(final_output, format="PNG")
-        return final_output
+        img = upright(open_image(input_path))
+        large = use_tiles(img)
+        if not large:
+            with stage('decode'): img = img.convert("RGBA")
+        content_key = content_key or content_digest(input_path)
+        if mask is None: mask = get_alpha_mask(img, content_key, model, speed)
+        final_output, save_options = raster_target(output_path, encoding, large)
+        if large:
+            return matting_tiled(img, mask, final_output, alpha_threshold, edge_shift,
+                                 stroke_width, stroke_color, stroke_pos, save_options['compress_level'])
+        result = matting_image(img, content_key, alpha_threshold, edge_shift, stroke_width, stroke_color, stroke_pos, mask,
+                               model=model, speed=speed)
+        return save_image(result, final_output, **save_options)
     except Exception as e:
         print(f"AI Error: {e}")
-        Image.open(input_path).save(output_path)
-        return output_path
+        if isinstance(output_path, MemoryOutput):
+            # 内存输出 (预览/批处理/任务) 要报告失败：原图当作结果返回会被结果缓存当成成功的抠图存下来
+            output_path.seek(0)
+            output_path.truncate()
+            output_path.ext = None
+            return None
+        return save_image(open_image(input_path), output_target(output_path, '.png'), format='PNG')
+
+def matting_image(img, content_key, alpha_threshold=10, edge_shift=0, stroke_width=0, stroke_color='#FFFFFF',
+                  stroke_pos='outer', mask=None, model=MATTING_MODEL, speed=MATTING_SPEED):
+    """内存版抠图：RGBA 图像进，RGBA 图像出 (描边时画布四周扩出 stroke_width+5)。
+    输出画布只分配一次；合成、阈值、修边、描边都原地写在画布上蒙版外接矩形 (+外扩/描边余量) 的视图里"""
+    if mask is None: mask = get_alpha_mask(img, content_key, model, speed)
+    pad = stroke_width + 5 if stroke_width > 0 else 0
+    canvas = np.zeros((img.height + 2 * pad, img.width + 2 * pad, 4), np.uint8)
+    # 余量按 FIELD_PAD_STEP 取整，调描边宽度/修边时裁剪框不变，距离场缓存仍然命中
+    margin = max(-edge_shift, 0) + max(stroke_width, 0) + 2
+    margin = -(-margin // FIELD_PAD_STEP) * FIELD_PAD_STEP
+    box = content_box(mask, margin, alpha_threshold)
+    if box is None: return Image.fromarray(canvas)
+    x0, y0, x1, y1 = clip_box([v + pad for v in box], canvas.shape[1], canvas.shape[0])
+    view = canvas[y0:y1, x0:x1]
+    ibox = clip_box(box, img.width, img.height)
+    with stage('composite'):
+        composite_into(view[ibox[1] + pad - y0:ibox[3] + pad - y0, ibox[0] + pad - x0:ibox[2] + pad - x0],
+                       img.crop(ibox), mask.crop(ibox))
+    # 修边和描边共用的距离场按 (图片, 模型, 速度档, 阈值, 视图在原图坐标中的位置) 缓存：不同模型/档位的蒙版不同
+    postprocess_alpha(view, alpha_threshold, edge_shift, stroke_width, stroke_color, stroke_pos,
+                      ('matting', content_key, model, speed, alpha_threshold, x0 - pad, y0 - pad, x1 - pad, y1 - pad))
+    return Image.fromarray(canvas)
+
+def remove_background_batch(sources, output_paths, content_keys=None, batch_size=None, **kwargs):
+    """批量抠图：未命中蒙版缓存的图片拼批推理，其余后处理与 remove_background_ai 相同，返回各文件输出路径"""
+    loaded = []
+    for i, src in enumerate(sources):
+        # 只解码不转 RGBA：超大图交给 remove_background_ai 的分条路径，推理前的缩放自己转 RGB
+        try:
+            img = upright(open_image(src))
+            img.load()
+            loaded.append((i, img))
+        except Exception: pass
+    keys = [(content_keys and content_keys[i]) or content_digest(sources[i]) for i, _ in loaded]
+    masks = get_alpha_masks([img for _, img in loaded], keys, kwargs.get('model', MATTING_MODEL), batch_size,
+                            kwargs.get('speed', MATTING_SPEED))
+    outputs = [None] * len(sources)
+    for (i, img), key, mask in zip(loaded, keys, masks):
+        outputs[i] = remove_background_ai(img, output_paths[i], content_key=key, mask=mask, **kwargs)
+    for i, src in enumerate(sources):
+        # 解码失败的文件交给单张流程，保持原来的出错处理
+        if outputs[i] is None:
+            try: outputs[i] = remove_background_ai(src, output_paths[i], content_key=content_keys and content_keys[i],
+                                                   **kwargs)
+            except Exception: pass
+    return outputs
+
+def matting_kwargs(threshold=10, shift=0, stroke_width=0, stroke_color='#FFFFFF', stroke_pos='outer', encoding=None,
+                   model=None, speed=None, **_):
+    return {'alpha_threshold': threshold, 'edge_shift': shift, 'stroke_width': stroke_width,
+            'stroke_color': stroke_color, 'stroke_pos': stroke_pos, 'encoding': encoding,
+            'model': matting_model(model), 'speed': matting_speed(speed)}
+
+def process_file(mode, src, output_path, indent=8, smoothness=4, radius=0, color='black',
+                 threshold=10, shift=0, stroke_width=0, stroke_color='#FFFFFF', stroke_pos='outer',
+                 content_key=None, min_area=50, encoding=None, steps=None, model=MATTING_MODEL, speed=MATTING_SPEED):
+    """按模式处理单个文件，返回实际输出路径（失败返回 None）。src 为路径、字节、NumPy 数组或 PIL 图像，
+    output_path 为路径或 MemoryOutput；encoding 为位图输出编码；model/speed 为抠图模型和速度档"""
+    png_output = output_target(output_path, ".png")
+    if mode == 'shrink':
+        if is_svg_source(src):
+            return process_bottle_svg(src, output_target(output_path, ".svg"), shrink_px=indent)
+        return process_raster_image(src, png_output, shrink_px=indent, content_key=content_key, encoding=encoding)
+    if mode == 'vectorize':
+        return convert_bitmap_to_svg(src, output_path, fill_color=color, smoothness=smoothness,
+                                     corner_radius=radius, min_area=min_area, content_key=content_key)
+    if mode == 'matting':
+        return remove_background_ai(src, png_output, content_key=content_key,
+                                    **matting_kwargs(threshold, shift, stroke_width, stroke_color, stroke_pos, encoding,
+                                                     model, speed))
+    if mode == 'pipeline':
+        return run_pipeline(src, output_path, parse_steps(steps), content_key, encoding)
+    return None
+
+# 多步流水线：一次请求按顺序执行若干步 (如 抠图 -> 内缩 -> 转矢量)，步与步之间直接传 RGBA 图像，只在最后编码一次
+PIPELINE_MODES = ('matting', 'shrink', 'vectorize')
+PIPELINE_MAX_STEPS = 8
+# 各步参数的类型转换，与 app.read_params 一致；不认识的参数丢弃
+STEP_PARAMS = {'indent': int, 'smoothness': int, 'radius': float, 'color': str, 'min_area': float, 'threshold': int,
+               'shift': int, 'stroke_width': int, 'stroke_color': str, 'stroke_pos': str,
+               'model': matting_model, 'speed': matting_speed}
+
+def parse_steps(steps):
+    """steps 为 [{'mode': ..., 参数...}] 或其 JSON 字符串；参数名与 process_file 相同。转矢量输出 SVG，只能是最后一步。
+    返回参数已转换好类型的新列表，步骤或参数不合法时抛 ValueError"""
+    if isinstance(steps, str): steps = json.loads(steps)
+    if not isinstance(steps, list) or not 0 < len(steps) <= PIPELINE_MAX_STEPS:
+        raise ValueError(f'steps 必须是 1~{PIPELINE_MAX_STEPS} 个步骤的列表')
+    parsed = []
+    for i, step in enumerate(steps):
+        if not isinstance(step, dict) or step.get('mode') not in PIPELINE_MODES:
+            raise ValueError(f'第 {i + 1} 步的 mode 必须是 {"/".join(PIPELINE_MODES)} 之一')
+        if step['mode'] == 'vectorize' and i != len(steps) - 1: raise ValueError('转矢量只能是最后一步')
+        values = {'mode': step['mode']}
+        for name, cast in STEP_PARAMS.items():
+            if name not in step: continue
+            value = step[name]
+            if value is None or isinstance(value, (list, dict)): raise ValueError(f'第 {i + 1} 步的参数 {name} 不合法')
+            try: values[name] = cast(value)
+            except (TypeError, ValueError): raise ValueError(f'第 {i + 1} 步的参数 {name} 不合法')
+        parsed.append(values)
+    return parsed
+
+def check_svg_steps(steps):
+    """SVG 没有栅格化，只能单独做矢量内缩"""
+    if [step['mode'] for step in steps] != ['shrink']: raise ValueError('SVG 输入只支持单独的内缩步骤')
+
+def step_key(content_key, step):
+    """中间结果的内容键：由输入的键和这一步的参数决定，后续步骤照常命中蒙版/距离场/轮廓缓存"""
+    return content_key and hashlib.sha1(json.dumps([content_key, step], sort_keys=True).encode()).hexdigest()
+
+def run_pipeline(src, output_path, steps, content_key=None, encoding=None):
+    if is_svg_source(src):
+        check_svg_steps(steps)
+        return process_bottle_svg(src, output_target(output_path, ".svg"), shrink_px=steps[0].get('indent', 8))
+    img = open_image(src)
+    if steps[0]['mode'] == 'matting': img = upright(img)
+    key = content_key or content_digest(src)
+    for step in steps:
+        params = {k: v for k, v in step.items() if k != 'mode'}
+        if step['mode'] == 'vectorize':
+            return convert_bitmap_to_svg(img, output_path, fill_color=params.get('color', 'black'),
+                                         smoothness=params.get('smoothness', 4), corner_radius=params.get('radius', 0),
+                                         min_area=params.get('min_area', 50), content_key=key)
+        if step['mode'] == 'matting':
+            with stage('decode'): img = img.convert("RGBA")
+            kwargs = matting_kwargs(**params)
+            kwargs.pop('encoding')
+            img = matting_image(img, key, **kwargs)
+        else:
+            img = shrink_image(img, params.get('indent', 8), key)
+        key = step_key(key, step)
+    final_output, save_options = raster_target(output_path, encoding)
+    return save_image(img, final_output, **save_options)
+
+def process_data(mode, src, **params):
+    """内存版 process_file：src 为字节 (位图或 SVG)、NumPy 数组或 PIL 图像，返回 (扩展名, 输出字节)，失败返回 None"""
+    output = MemoryOutput()
+    result = process_file(mode, src, output, **params)
+    if not result or not output.ext or not output.tell(): return None
+    return output.ext, output.getvalue()
+
+def process_files_batch(mode, sources, output_paths, content_keys=None, **params):
+    """批量版 process_file：抠图走批量推理，其它模式逐个处理"""
+    if mode == 'matting':
+        png_outputs = [output_target(p, ".png") for p in output_paths]
+        return remove_background_batch(sources, png_outputs, content_keys, **matting_kwargs(**params))
+    return [process_file(mode, src, out, content_key=(content_keys[i] if content_keys else None), **params)
+            for i, (src, out) in enumerate(zip(sources, output_paths))]
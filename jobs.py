@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import hashlib
+import tempfile
+import threading
+from batch import run_batch, iter_zip
+
+# 后台批处理任务：本地队列 + 少量调度线程，真正的计算在 batch 进程池里完成，web worker 保持空闲服务预览
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+# 任务状态 (JSON) 和结果 ZIP 放在各 worker 共享的目录里，请求落到哪个 worker 都能查到
+JOB_DIR = os.environ.get('JOB_DIR') or os.path.join(tempfile.gettempdir(), 'bottle_jobs')
+# 其他 worker 的任务没有条件变量可等，按这个间隔 (秒) 重读状态文件
+JOB_POLL = float(os.environ.get('JOB_POLL', 1))
+# SSE 长连接各占一个 gthread 线程：同时最多 JOB_EVENT_STREAMS 条，每条最长 JOB_EVENTS_TIMEOUT 秒后断开让浏览器重连
+JOB_EVENT_STREAMS = int(os.environ.get('JOB_EVENT_STREAMS', 2))
+JOB_EVENTS_TIMEOUT = float(os.environ.get('JOB_EVENTS_TIMEOUT', 30))
+JOB_EVENTS_RETRY = float(os.environ.get('JOB_EVENTS_RETRY', 2))
+# 需要落盘的字段；params 和上传文件的位置只在提交任务的 worker 内存里
+STATE_FIELDS = ('id', 'mode', 'status', 'error', 'created', 'started', 'finished', 'archive_path', 'files', 'version')
+
+def read_bytes(path):
+    with open(path, 'rb') as f: return f.read()
+
+class Job:
+    def __init__(self, mode, sources, params):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.params = params
+        self.sources = sources
+        self.status = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.archive_path = None
+        self.files = [{'name': name, 'status': 'pending', 'output': None, 'error': None, 'timings': {}}
+                      for name, _, _ in sources]
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def touch(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def wait(self, version, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def state(self):
+        return {name: getattr(self, name) for name in STATE_FIELDS}
+
+    @classmethod
+    def restore(cls, state):
+        """从状态文件恢复的只读副本 (其他 worker 提交的任务)"""
+        job = cls.__new__(cls)
+        job.__dict__.update({name: state.get(name) for name in STATE_FIELDS})
+        job.sources = job.params = None
+        job.changed = threading.Condition()
+        return job
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        finished_files = sum(1 for f in self.files if f['status'] in ('done', 'failed'))
+        stages = {}
+        if self.started: stages['queued'] = round(self.started - self.created, 4)
+        if self.started and self.finished: stages['processing'] = round(self.finished - self.started, 4)
+        return {'id': self.id, 'mode': self.mode, 'status': self.status, 'error': self.error,
+                'total': len(self.files), 'completed': finished_files,
+                'failed': sum(1 for f in self.files if f['status'] == 'failed'),
+                'stages': stages, 'files': self.files}
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL, directory=JOB_DIR):
+        self.ttl = ttl
+        self.workers = workers
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.archive_dir = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        # 调度线程在第一次提交任务时才启动（gunicorn fork 之后）
+        if self._threads: return
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._worker, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.archive_dir, job_id + ext)
+
+    def _remove(self, job_id):
+        for ext in ('.json', '.zip'):
+            try: os.remove(self._path(job_id, ext))
+            except OSError: pass
+        shutil.rmtree(self._path(job_id, '.in'), ignore_errors=True)
+
+    def _store_sources(self, job_id, sources):
+        """上传的字节写进任务目录，排队期间不占 web 进程内存；返回 [(文件名, 文件路径, 摘要)]"""
+        directory = self._path(job_id, '.in')
+        os.makedirs(directory, exist_ok=True)
+        stored = []
+        for index, (name, data, digest) in enumerate(sources):
+            path = os.path.join(directory, str(index))
+            with open(path, 'wb') as f: f.write(data)
+            stored.append((name, path, digest or hashlib.sha1(data).hexdigest()))
+        return stored
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [k for k, j in self.jobs.items() if j.done and now - j.finished > self.ttl]:
+            self.jobs.pop(job_id)
+            self._remove(job_id)
+
+    def _sweep(self):
+        # 已退出的 worker 留下的任务文件：状态超过 ttl 没有更新就删掉
+        now = time.time()
+        with os.scandir(self.archive_dir) as entries:
+            for entry in entries:
+                job_id, ext = os.path.splitext(entry.name)
+                if ext not in ('.json', '.in') or job_id in self.jobs: continue
+                try: stale = now - entry.stat().st_mtime > self.ttl
+                except OSError: continue
+                if stale: self._remove(job_id)
+
+    def _save(self, job):
+        # 先写临时文件再替换，其他 worker 读不到写了一半的状态
+        path = self._path(job.id, '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f: json.dump(job.state(), f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def _load(self, job_id):
+        if not job_id.isalnum(): return None
+        try:
+            with open(self._path(job_id, '.json'), encoding='utf-8') as f: return Job.restore(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _touch(self, job):
+        job.touch()
+        self._save(job)
+
+    def submit(self, mode, sources, params):
+        job = Job(mode, sources, params)
+        job.sources = self._store_sources(job.id, sources)
+        with self._lock:
+            self._expire()
+            self._sweep()
+            self.jobs[job.id] = job
+            self._start()
+        self._save(job)
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            job = self.jobs.get(job_id)
+        return job or self._load(job_id)
+
+    def wait(self, job, version, timeout):
+        """等任务状态从 version 变化，返回最新的任务；其他 worker 的任务按 JOB_POLL 间隔重读状态文件"""
+        if job.id in self.jobs:
+            job.wait(version, timeout)
+            return job
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return job
+            time.sleep(min(JOB_POLL, remaining))
+            latest = self._load(job.id)
+            if latest is not None and latest.version != version: return latest
+
+    @property
+    def depth(self):
+        """本 worker 排队和运行中的任务数"""
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if not job.done)
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try: self._run(job)
+            except Exception as e:
+                job.status, job.error = 'failed', str(e)
+                job.finished = time.time()
+                self._touch(job)
+            finally:
+                job.sources = None
+                shutil.rmtree(self._path(job.id, '.in'), ignore_errors=True)
+                self.queue.task_done()
+
+    def _progress(self, job, results):
+        # 逐个文件更新进度，再交给 iter_zip 写入归档
+        for index, result in enumerate(results):
+            filename, out_name, _, error, timings = result
+            entry = job.files[index]
+            entry.update(status='failed' if error else 'done', output=out_name, error=error,
+                         timings={k: round(v, 4) for k, v in timings.items()})
+            self._touch(job)
+            yield result
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        self._touch(job)
+        archive_path = self._path(job.id, '.zip')
+        with open(archive_path, 'wb') as f:
+            for chunk in iter_zip(self._progress(job, run_batch(job.mode, job.sources, job.params, read_bytes))):
+                f.write(chunk)
+        job.archive_path = archive_path
+        ok = any(f['status'] == 'done' for f in job.files)
+        job.status = 'done' if ok else 'failed'
+        if not ok: job.error = '处理失败'
+        job.finished = time.time()
+        self._touch(job)
+
+job_manager = JobManager()
@@ -0,0 +1,150 @@
+import time
+import bisect
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 分阶段计时：stage() 记录一段耗时，按阶段汇总成 Prometheus 直方图；请求内的阶段同时写入 Server-Timing 响应头
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1KB ~ 256MB
+
+def _labels(names, values):
+    if not names: return ''
+    return '{' + ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values)) + '}'
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, tuple(labelnames), tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None: series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets): series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock: self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            lines += [f'{self.name}{_labels(self.labelnames, k)} {v}' for k, v in sorted(self._values.items())]
+        return lines
+
+def gauge(name, help_text, values, labelnames=(), kind='gauge'):
+    """即时值：values 为 {标签元组: 数值}，在 /metrics 被抓取时现算；已有的累计计数 (如缓存命中数) 用 kind='counter'"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{_labels(labelnames, k)} {v}' for k, v in values.items() if v is not None]
+    return lines
+
+stage_seconds = Histogram('bottle_stage_seconds', '各处理阶段耗时 (秒)', ('stage',))
+stage_bytes = Histogram('bottle_stage_bytes', '各阶段处理的数据量 (字节)', ('stage',), BYTES_BUCKETS)
+request_seconds = Histogram('bottle_request_seconds', 'HTTP 请求耗时 (秒)', ('endpoint', 'status'))
+requests_total = Counter('bottle_requests_total', 'HTTP 请求数', ('endpoint', 'status'))
+
+class StageRecorder:
+    """一次请求 (或一次 worker 任务) 内各阶段的累计耗时和字节数；capture=True 时只记录不进全局直方图，由调用方统一上报"""
+    def __init__(self, capture=False):
+        self.capture = capture
+        self.started = time.perf_counter()
+        self.durations = OrderedDict()
+        self.bytes = OrderedDict()
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def add_bytes(self, name, n):
+        self.bytes[name] = self.bytes.get(name, 0) + n
+
+_local = threading.local()
+
+def current_recorder():
+    return getattr(_local, 'recorder', None)
+
+def start_recording(capture=False):
+    """在当前线程上开始记录；stop_recording 时恢复外层记录器 (可嵌套)"""
+    recorder = StageRecorder(capture)
+    recorder.previous = current_recorder()
+    _local.recorder = recorder
+    return recorder
+
+def stop_recording(recorder):
+    _local.recorder = recorder.previous
+
+@contextmanager
+def recording(capture=False):
+    recorder = start_recording(capture)
+    try: yield recorder
+    finally: stop_recording(recorder)
+
+@contextmanager
+def stage(name):
+    t0 = time.perf_counter()
+    try: yield
+    finally: add_stage(name, time.perf_counter() - t0)
+
+def add_stage(name, seconds):
+    recorder = current_recorder()
+    if recorder is not None: recorder.add(name, seconds)
+    if recorder is None or not recorder.capture: stage_seconds.observe(seconds, name)
+
+def add_bytes(name, n):
+    recorder = current_recorder()
+    if recorder is not None: recorder.add_bytes(name, n)
+    if recorder is None or not recorder.capture: stage_bytes.observe(n, name)
+
+def observe_stages(durations, byte_counts=None):
+    """上报在别的进程里 capture 下来的阶段数据 (进程池 worker 的直方图主进程看不到)"""
+    for name, seconds in durations.items(): add_stage(name, seconds)
+    for name, n in (byte_counts or {}).items(): add_bytes(name, n)
+
+def server_timing(recorder, total=None):
+    """Server-Timing 头：各阶段耗时 (毫秒)，附带字节数说明"""
+    parts = []
+    for name, seconds in recorder.durations.items():
+        desc = f';desc="{recorder.bytes[name]} bytes"' if name in recorder.bytes else ''
+        parts.append(f'{name};dur={seconds * 1000:.1f}{desc}')
+    for name, n in recorder.bytes.items():
+        if name not in recorder.durations: parts.append(f'{name};desc="{n} bytes"')
+    if total is not None: parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+def rss_bytes(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'): return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def render(extra=()):
+    """Prometheus 文本格式：直方图/计数器 + 调用方传入的即时指标行"""
+    lines = []
+    for metric in (stage_seconds, stage_bytes, request_seconds, requests_total): lines += metric.render()
+    for block in extra: lines += block
+    return '\n'.join(lines) + '\n'
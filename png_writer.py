@@ -0,0 +1,60 @@
+import os
+import zlib
+import struct
+import numpy as np
+
+# 流式 PNG 编码：按行块写入，压缩后的数据边产生边落盘，内存只和行块大小有关
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+PNG_IDAT_BYTES = 1 << 16
+COLOR_TYPES = {'L': (0, 1), 'RGB': (2, 3), 'RGBA': (6, 4)}
+
+def _chunk(fp, tag, data):
+    fp.write(struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+class PngStreamWriter:
+    """逐块写 8 位 PNG：write(rows) 接收 (n, width[, channels]) 的 uint8 数组，统一用 Up 滤波 (与上一行做差)。
+    output_path 也可以是二进制文件对象 (如 BytesIO)，写完不关闭"""
+    def __init__(self, output_path, width, height, mode='RGBA', compress_level=PNG_COMPRESS_LEVEL):
+        color_type, self.channels = COLOR_TYPES[mode]
+        self.width, self.height = width, height
+        self.rows_written = 0
+        self.owns_fp = isinstance(output_path, (str, os.PathLike))
+        self.fp = open(output_path, 'wb') if self.owns_fp else output_path
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        _chunk(self.fp, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+        self._zip = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_bytes = 0
+        self._prev = np.zeros((1, width * self.channels), dtype=np.uint8)
+
+    def _emit(self, data, force=False):
+        if data:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+        if self._pending_bytes >= PNG_IDAT_BYTES or (force and self._pending):
+            _chunk(self.fp, b'IDAT', b''.join(self._pending))
+            self._pending, self._pending_bytes = [], 0
+
+    def write(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), -1)
+        if not len(rows): return
+        filtered = rows - np.vstack((self._prev, rows[:-1]))
+        self._prev = rows[-1:].copy()
+        lines = np.empty((len(rows), filtered.shape[1] + 1), dtype=np.uint8)
+        lines[:, 0] = 2
+        lines[:, 1:] = filtered
+        self._emit(self._zip.compress(lines.tobytes()))
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self.rows_written != self.height: raise ValueError(f'PNG 行数不符: {self.rows_written}/{self.height}')
+        self._emit(self._zip.flush(), force=True)
+        _chunk(self.fp, b'IEND', b'')
+        if self.owns_fp: self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None: self.close()
+        elif self.owns_fp: self.fp.close()
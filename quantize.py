@@ -0,0 +1,15 @@
+import argparse
+from gen_bottle_mask_4 import quantize_model, base_model, MATTING_MODELS, QUANTIZE_METHOD, INT8_SUFFIX
+
+# 离线生成抠图模型的 int8 版本：在构建阶段跑一次，web 请求里就不会碰上首次量化 (静态量化要跑校准，可能超过请求超时)。
+# 生成的文件要写到运行时仍在的位置 (QUANTIZED_MODEL_DIR)，release 阶段的容器不会把文件留给 web 进程
+def main():
+    parser = argparse.ArgumentParser(description='生成抠图模型的 int8 量化版本 (已存在时跳过)')
+    parser.add_argument('models', nargs='*', help='float 模型名 (默认为 MATTING_MODELS 里带 -int8 的模型)')
+    parser.add_argument('--method', choices=('static', 'dynamic'), default=QUANTIZE_METHOD, help='量化方式')
+    args = parser.parse_args()
+    names = args.models or [base_model(m) for m in MATTING_MODELS if m.endswith(INT8_SUFFIX)]
+    for name in names: print(f"{name} -> {quantize_model(name, args.method)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import os
+import json
+import hashlib
+import inspect
+import tempfile
+import threading
+from collections import OrderedDict
+from gen_bottle_mask_4 import LRUCache, process_file, matting_model, matting_speed, EXPORT_ENCODING
+
+# 结果缓存：键 = 输入内容摘要 + 模式 + 规范化后的参数；内存层 (RESULT_CACHE_MB) + 可选磁盘层 (RESULT_CACHE_DIR)
+RESULT_CACHE_MB = int(os.environ.get('RESULT_CACHE_MB', 32))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '')
+RESULT_CACHE_DISK_MB = int(os.environ.get('RESULT_CACHE_DISK_MB', 1024))
+# 处理算法变化时改这个版本号，让磁盘上的旧结果失效
+RESULT_CACHE_VERSION = '2'
+
+# 各模式真正影响输出的参数，默认值取自 process_file 的签名
+MODE_PARAMS = {'shrink': ('indent',), 'vectorize': ('smoothness', 'radius', 'color', 'min_area'),
+               'matting': ('threshold', 'shift', 'stroke_width', 'stroke_color', 'stroke_pos')}
+DEFAULTS = {name: p.default for name, p in inspect.signature(process_file).parameters.items()
+            if p.default is not inspect.Parameter.empty}
+
+def _normalize(value):
+    if isinstance(value, str): return value.strip().lower()
+    if isinstance(value, (int, float)) and float(value).is_integer(): return int(value)
+    return value
+
+def mode_values(mode, params):
+    values = {name: _normalize(params.get(name, DEFAULTS.get(name))) for name in MODE_PARAMS.get(mode, ())}
+    if mode == 'matting':
+        # 模型和速度档按实际生效的值计入 (不在允许列表里的会退回默认值)
+        values['model'], values['speed'] = matting_model(params.get('model')), matting_speed(params.get('speed'))
+        # 不描边时描边颜色/位置不影响结果
+        if values['stroke_width'] <= 0: values.pop('stroke_color'), values.pop('stroke_pos')
+    return values
+
+def result_key(digest, mode, params, max_edge=0, encoding=None):
+    """同一输入、同一模式、等价参数得到同一个键；预览代理图的最长边和输出编码也算在内。流水线按每一步的模式和参数计算"""
+    if mode == 'pipeline':
+        values = {'steps': [dict(mode_values(step['mode'], step), mode=step['mode']) for step in params.get('steps') or []]}
+    else:
+        values = mode_values(mode, params)
+    raw = json.dumps([RESULT_CACHE_VERSION, digest, mode, values, max_edge or 0, encoding or EXPORT_ENCODING],
+                     sort_keys=True)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def source_keys(mode, sources, params):
+    """批处理输入 [(文件名, 字节, 摘要或 None)] -> 补全摘要后的 sources 和对应的结果键"""
+    sources = [(name, data, digest or hashlib.sha1(data).hexdigest()) for name, data, digest in sources]
+    return sources, [result_key(digest, mode, params) for _, _, digest in sources]
+
+class DiskTier:
+    """磁盘层：每个结果一个文件，按总大小做 LRU 淘汰 (命中时更新 mtime)"""
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try: st = os.stat(path)
+            except OSError: continue
+            if name.startswith('.') or not os.path.isfile(path): continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[os.path.splitext(name)[0]] = (name, size)
+            self.size += size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None: return None
+            self._index.move_to_end(key)
+        path = os.path.join(self.directory, entry[0])
+        try:
+            with open(path, 'rb') as f: data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                if self._index.pop(key, None): self.size -= entry[1]
+            return None
+        return os.path.splitext(entry[0])[1], data
+
+    def put(self, key, ext, data):
+        if len(data) > self.max_bytes: return
+        name = key + ext
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f: f.write(data)
+        os.replace(tmp, os.path.join(self.directory, name))
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old: self.size -= old[1]
+            self._index[key] = (name, len(data))
+            self.size += len(data)
+            evicted = []
+            while self.size > self.max_bytes and self._index:
+                _, (old_name, n) = self._index.popitem(last=False)
+                self.size -= n
+                evicted.append(old_name)
+        for old_name in evicted:
+            try: os.remove(os.path.join(self.directory, old_name))
+            except OSError: pass
+
+class ResultCache:
+    """get/put 的值为 (扩展名, 输出字节)；内存层未命中时查磁盘层，命中后回填内存层"""
+    def __init__(self, memory_bytes, directory='', disk_bytes=0):
+        self.memory = LRUCache(memory_bytes)
+        self.disk = DiskTier(directory, disk_bytes) if directory else None
+        self.disk_hits = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.put(key, value, len(value[1]))
+        return value
+
+    def put(self, key, ext, data):
+        self.memory.put(key, (ext, data), len(data))
+        if self.disk:
+            try: self.disk.put(key, ext, data)
+            except OSError: pass
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        if self.disk: stats.update(disk_bytes=self.disk.size, disk_entries=len(self.disk._index))
+        return stats
+
+result_cache = ResultCache(RESULT_CACHE_MB * 1024 * 1024, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MB * 1024 * 1024)
+
+def cached_name(filename, ext):
+    return os.path.splitext(filename)[0] + ext
+
+def etag_for(keys):
+    """单个结果直接用结果键；多个结果 (ZIP) 用按顺序拼起来的文件名和键再取摘要"""
+    if isinstance(keys, str): return keys
+    return hashlib.sha1(json.dumps(keys).encode()).hexdigest()
@@ -0,0 +1,120 @@
+import os
+import numpy as np
+from xml.sax.saxutils import quoteattr
+
+# 输出 SVG 的坐标小数位数、是否使用相对坐标命令 (更短)
+SVG_PRECISION = int(os.environ.get('SVG_PRECISION', 2))
+SVG_RELATIVE = os.environ.get('SVG_RELATIVE', '1') == '1'
+
+def quantize(coords, precision=SVG_PRECISION):
+    """坐标按精度取整为整数网格；相对坐标在整数上做差分，不会累积舍入误差"""
+    return np.round(np.asarray(coords, dtype=float) * 10 ** precision).astype(np.int64)
+
+def _formatter(precision):
+    scale = 10 ** precision
+    def fmt(q):
+        if not precision: return str(q)
+        i, f = divmod(abs(q), scale)
+        s = str(i) if not f else (f"{i}.{f:0{precision}d}".rstrip('0') if i else f".{f:0{precision}d}".rstrip('0'))
+        return '-' + s if q < 0 else s
+    return fmt
+
+# 相对坐标的取值高度重复，格式化结果按精度缓存
+_token_cache = {}
+
+def _tokens(values, precision):
+    cache = _token_cache.setdefault(precision, {})
+    if len(cache) > 200000: cache.clear()
+    fmt = _formatter(precision)
+    return [cache[v] if v in cache else cache.setdefault(v, fmt(v)) for v in values]
+
+def _join(tokens):
+    # 负号本身就能分隔数字，省掉多余的空格；命令字母前后也不需要空格
+    return ' '.join(tokens).replace(' -', '-')
+
+def _dedupe(q):
+    if len(q) > 1 and (q[-1] == q[0]).all(): q = q[:-1]
+    if len(q) > 1:
+        keep = np.ones(len(q), dtype=bool)
+        keep[1:] = (q[1:] != q[:-1]).any(axis=1)
+        q = q[keep]
+    return q
+
+def ring_d(coords, precision=SVG_PRECISION, relative=SVG_RELATIVE):
+    """闭合折线 (k, 2) -> path data；重复的终点和相邻重合点会被去掉"""
+    q = _dedupe(quantize(coords, precision))
+    if len(q) < 3: return ""
+    head = "M" + _join(_tokens(q[0].tolist(), precision))
+    if relative:
+        return head + "l" + _join(_tokens(np.diff(q, axis=0).ravel().tolist(), precision)) + "z"
+    return head + "L" + _join(_tokens(q[1:].ravel().tolist(), precision)) + "Z"
+
+def rings_d(rings, precision=SVG_PRECISION, relative=SVG_RELATIVE):
+    return "".join(ring_d(r, precision, relative) for r in rings)
+
+def rounded_ring_d(start, line_targets, ctrls, curve_ends, precision=SVG_PRECISION, relative=SVG_RELATIVE):
+    """圆角多边形：M 起点，然后每个顶点一条 L 直线 + 一条 Q 二次曲线，最后 Z"""
+    s = quantize(start, precision)
+    lt, ct, ce = (quantize(a, precision) for a in (line_targets, ctrls, curve_ends))
+    if relative:
+        prev = np.vstack((s[None, :], ce[:-1]))
+        lt, ct, ce = lt - prev, ct - lt, ce - lt
+        cmd_l, cmd_q, close = "l", "q", "z"
+    else:
+        cmd_l, cmd_q, close = "L", "Q", "Z"
+    # 每行 [l x y q cx cy x y]，整体用空格拼接，再去掉命令字母两侧和负号前的空格
+    rows = np.empty((len(lt), 8), dtype=object)
+    rows[:, 0], rows[:, 3] = cmd_l, cmd_q
+    rows[:, 1:3] = np.array(_tokens(lt.ravel().tolist(), precision), dtype=object).reshape(-1, 2)
+    rows[:, 4:] = np.array(_tokens(np.hstack((ct, ce)).ravel().tolist(), precision), dtype=object).reshape(-1, 4)
+    d = ' '.join(['M'] + _tokens(s.tolist(), precision) + rows.ravel().tolist())
+    d = d.replace(f' {cmd_l} ', cmd_l).replace(f' {cmd_q} ', cmd_q).replace(' -', '-')
+    return 'M' + d[2:] + close
+
+class SvgWriter:
+    """流式写 SVG：不经过 parse_path/wsvg，直接把 path data 写入文件；merge=True 时相同属性的路径合并成一个 <path>"""
+    def __init__(self, fp, svg_attrs, merge=True, owns_fp=False):
+        self.fp = fp
+        self.merge = merge
+        self.owns_fp = owns_fp
+        self._groups = {}
+        attrs = dict(svg_attrs)
+        attrs.setdefault('xmlns', 'http://www.w3.org/2000/svg')
+        self.fp.write('<?xml version="1.0" encoding="utf-8"?>\n<svg' +
+                      ''.join(f' {k}={quoteattr(str(v))}' for k, v in attrs.items()) + '>\n')
+
+    def _write(self, d, attrs):
+        self.fp.write('<path d="' + d + '"' + ''.join(f' {k}={quoteattr(str(v))}' for k, v in attrs.items()) + '/>\n')
+
+    def add_path(self, d, attrs, merge=None):
+        if not d: return
+        if self.merge if merge is None else merge:
+            self._groups.setdefault(tuple(sorted(attrs.items())), []).append(d)
+        else:
+            self._write(d, attrs)
+
+    def close(self):
+        for key, ds in self._groups.items(): self._write("".join(ds), dict(key))
+        self._groups.clear()
+        self.fp.write('</svg>\n')
+        if self.owns_fp: self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None: self.close()
+        elif self.owns_fp: self.fp.close()
+
+class _Utf8Writer:
+    """把 str 编码后写进二进制文件对象 (如 BytesIO)，不接管它的关闭"""
+    def __init__(self, fp):
+        self._fp = fp
+
+    def write(self, text):
+        return self._fp.write(text.encode('utf-8'))
+
+def open_svg(output, svg_attrs, merge=True):
+    """output 为文件路径，或写完后仍由调用方持有的二进制文件对象"""
+    if not isinstance(output, str): return SvgWriter(_Utf8Writer(output), svg_attrs, merge)
+    return SvgWriter(open(output, 'w', encoding='utf-8'), svg_attrs, merge, owns_fp=True)